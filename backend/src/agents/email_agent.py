@@ -3,23 +3,99 @@
 from typing import Dict, List, Optional
 import os
 from datetime import datetime
-import mimetypes
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from src.tools.shared_tools import (
+from tools.shared_tools import (
     debug_print,
     format_error,
+    get_io_pool,
     get_safe_filename,
+    link_or_copy,
     format_timestamp,
-    ensure_directory
+    ensure_directory,
+    get_composio_tool,
+    prefetch_composio_tools
 )
-from src.composio_client import get_tool
 
-# Initialize Gmail tools globally
-FETCH_TOOL = get_tool('GMAIL_FETCH_EMAILS')
-ATTACHMENT_TOOL = get_tool('GMAIL_GET_ATTACHMENT')
+# Discover Gmail tools in the background while the rest of the app loads
+prefetch_composio_tools(['GMAIL_FETCH_EMAILS', 'GMAIL_GET_ATTACHMENT'])
+
+# Default Gmail search query for invoice emails; Gmail filters out messages
+# without a PDF attachment, so they are never fetched or processed
+DEFAULT_QUERY = "has:attachment filename:pdf newer_than:7d"
+
+# Shared read-only stand-in for messages without a preview
+_NO_PREVIEW = MappingProxyType({})
+
+def _get_response_data(result: Dict) -> Optional[Dict]:
+    """Return the 'response_data' payload of a Gmail fetch response, if any
+    
+    Looks each level up directly instead of chaining .get(key, {}), so empty
+    polls don't allocate throwaway dicts.
+    """
+    data = result.get('data')
+    return data.get('response_data') if data else None
+
+def _process_email_response(
+    result: Dict,
+    executor: Optional[ThreadPoolExecutor] = None,
+    download_dir: str = "downloads",
+    debug: bool = False
+) -> List[Dict]:
+    """Convert a Gmail fetch response into processed email dictionaries
+    
+    Args:
+        result (dict): Raw response from the Gmail fetch tool
+        executor (ThreadPoolExecutor, optional): If given, attachment downloads
+            are submitted as soon as each message is parsed and their futures
+            are stored under 'download_futures'
+        download_dir (str): Directory to save attachments
+        debug (bool): Enable debug output
+        
+    Returns:
+        list: Processed emails
+    """
+    response_data = _get_response_data(result)
+    messages = response_data.get('messages') if response_data else None
+    if not messages:
+        return []
+    
+    # Built with comprehensions rather than per-message appends
+    _format_timestamp = format_timestamp
+    processed_emails = [{
+        'message_id': msg.get('messageId'),
+        'thread_id': msg.get('threadId'),
+        'timestamp': _format_timestamp(msg.get('messageTimestamp')),
+        'subject': msg.get('subject', ''),
+        'sender': msg.get('sender', ''),
+        'labels': msg.get('labelIds', []),
+        'preview': (msg.get('preview') or _NO_PREVIEW).get('body', ''),
+        'attachments': [{
+            'filename': att.get('filename', ''),
+            'attachment_id': att.get('attachmentId', ''),
+            'mime_type': att.get('mimeType', '')
+        } for att in msg.get('attachmentList') or ()]
+    } for msg in messages]
+    
+    if executor is not None:
+        for email_data in processed_emails:
+            email_data['download_futures'] = [
+                executor.submit(
+                    download_attachment,
+                    message_id=email_data['message_id'],
+                    attachment_id=att['attachment_id'],
+                    filename=att['filename'],
+                    download_dir=download_dir,
+                    debug=debug
+                )
+                for att in email_data['attachments']
+            ]
+    
+    return processed_emails
 
 def fetch_emails(
-    query: str = "has:attachment newer_than:7d",
+    query: str = DEFAULT_QUERY,
     max_results: int = 15,
     include_spam_trash: bool = False,
     debug: bool = False
@@ -44,7 +120,7 @@ def fetch_emails(
             })
         
         # Call Gmail fetch tool
-        result = FETCH_TOOL.run({
+        result = get_composio_tool('GMAIL_FETCH_EMAILS').run({
             'query': query,
             'max_results': max_results,
             'user_id': 'me',
@@ -55,27 +131,7 @@ def fetch_emails(
             return {"success": False, "error": "Invalid response from Gmail API"}
         
         # Process response
-        data = result.get('data', {})
-        response_data = data.get('response_data', {})
-        messages = response_data.get('messages', [])
-        
-        processed_emails = []
-        for msg in messages:
-            email_data = {
-                'message_id': msg.get('messageId'),
-                'thread_id': msg.get('threadId'),
-                'timestamp': format_timestamp(msg.get('messageTimestamp')),
-                'subject': msg.get('subject', ''),
-                'sender': msg.get('sender', ''),
-                'labels': msg.get('labelIds', []),
-                'preview': msg.get('preview', {}).get('body', ''),
-                'attachments': [{
-                    'filename': att.get('filename', ''),
-                    'attachment_id': att.get('attachmentId', ''),
-                    'mime_type': att.get('mimeType', '')
-                } for att in msg.get('attachmentList', [])]
-            }
-            processed_emails.append(email_data)
+        processed_emails = _process_email_response(result, debug=debug)
         
         response = {
             "success": True,
@@ -89,9 +145,60 @@ def fetch_emails(
         return response
         
     except Exception as e:
-        error = format_error(e)
         if debug:
-            debug_print("Fetch Error", error)
+            debug_print("Fetch Error", format_error(e))
+        return {"success": False, "error": str(e)}
+
+def fetch_emails_with_attachments(
+    query: str = DEFAULT_QUERY,
+    max_results: int = 15,
+    include_spam_trash: bool = False,
+    download_dir: str = "downloads",
+    debug: bool = False
+) -> Dict:
+    """Fetch emails and start downloading their attachments as they are parsed
+    
+    Each returned email carries a 'download_futures' list of futures that
+    resolve to download_attachment results; consume them with
+    concurrent.futures.as_completed.
+    
+    Args:
+        query (str): Gmail search query
+        max_results (int): Maximum number of results
+        include_spam_trash (bool): Include spam/trash folders
+        download_dir (str): Directory to save attachments
+        debug (bool): Enable debug output
+        
+    Returns:
+        dict: Processed email results with pending downloads
+    """
+    try:
+        result = get_composio_tool('GMAIL_FETCH_EMAILS').run({
+            'query': query,
+            'max_results': max_results,
+            'user_id': 'me',
+            'include_spam_trash': include_spam_trash
+        })
+        
+        if not result or not isinstance(result, dict):
+            return {"success": False, "error": "Invalid response from Gmail API"}
+        
+        processed_emails = _process_email_response(
+            result,
+            executor=get_io_pool(),
+            download_dir=download_dir,
+            debug=debug
+        )
+        
+        return {
+            "success": True,
+            "total_emails": len(processed_emails),
+            "emails": processed_emails
+        }
+        
+    except Exception as e:
+        if debug:
+            debug_print("Fetch Error", format_error(e))
         return {"success": False, "error": str(e)}
 
 def download_attachment(
@@ -125,7 +232,7 @@ def download_attachment(
         download_dir = ensure_directory(download_dir)
         
         # Call Gmail attachment tool
-        result = ATTACHMENT_TOOL.run({
+        result = get_composio_tool('GMAIL_GET_ATTACHMENT').run({
             'message_id': message_id,
             'attachment_id': attachment_id,
             'file_name': filename,
@@ -140,8 +247,7 @@ def download_attachment(
             
             try:
                 # Copy file to download directory
-                import shutil
-                shutil.copy2(file_path, target_path)
+                link_or_copy(file_path, target_path)
                 
                 response = {
                     'success': True,
@@ -175,28 +281,24 @@ def download_attachment(
             return error
             
     except Exception as e:
-        error = format_error(e)
         if debug:
-            debug_print("Download Error", error)
+            debug_print("Download Error", format_error(e))
         return {"success": False, "error": str(e)}
 
 def main():
     """Example usage of email functions"""
     try:
-        # Fetch emails with attachments
-        result = fetch_emails(max_results=5, debug=True)
+        # Fetch emails; attachment downloads start while the list is parsed
+        result = fetch_emails_with_attachments(max_results=5, debug=True)
         
         if result["success"] and result["emails"]:
-            # Download first attachment from first email
-            email = result["emails"][0]
-            if email["attachments"]:
-                attachment = email["attachments"][0]
-                download_attachment(
-                    message_id=email["message_id"],
-                    attachment_id=attachment["attachment_id"],
-                    filename=attachment["filename"],
-                    debug=True
-                )
+            futures = [f for email in result["emails"] for f in email["download_futures"]]
+            for future in as_completed(futures):
+                download = future.result()
+                if download.get("success"):
+                    print(f"✅ Downloaded: {download['file_path']}")
+                else:
+                    print(f"❌ Download failed: {download.get('error')}")
                 
     except Exception as e:
         print(f"❌ Error: {str(e)}")
@@ -1,10 +1,15 @@
 """Payment agent for processing invoice payments using Payman AI and Langchain."""
 
-from typing import Dict, Optional, List, Any
+from typing import Dict, Optional, List
 import os
-import json
+import asyncio
+import functools
+import orjson
+import sqlite3
+import threading
+import logging
+import ijson
 from datetime import datetime
-import traceback
 from pathlib import Path
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
@@ -14,22 +19,17 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.tools import Tool
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
-from composio_langchain import ComposioToolSet
 from langsmith import Client
 from tools.shared_tools import (
+    configure_logging,
     format_error,
     format_currency,
+    find_json_span,
     ensure_directory,
-    DEBUG,
-    debug_print
+    get_composio_tool
 )
 
-from tools.payment_tools import (
-    BalanceTool,
-    SearchPayeesTool,
-    SendPaymentTool,
-    CheckoutUrlTool
-)
+from tools.payment_tools import TOOLS_BY_NAME, get_spendable_balance
 
 # Load environment variables
 load_dotenv()
@@ -42,21 +42,91 @@ openai_api_key = os.getenv("OPENAI_API_KEY")
 if not openai_api_key:
     raise ValueError("OPENAI_API_KEY environment variable not found")
 
-# Initialize OpenAI client
-openai_client = ChatOpenAI(
-    model="gpt-4-turbo-preview",
-    temperature=0,
-    api_key=openai_api_key
+# Logging is configured by the entry point (see configure_logging)
+logger = logging.getLogger(__name__)
+
+# Record of every payment attempt, used to skip duplicate invoices. History
+# lives in SQLite, indexed on the duplicate-check keys; the older JSON file is
+# imported into it once
+PAYMENT_HISTORY_DB = Path("invoice data/payment_history.db")
+PAYMENT_HISTORY_FILE = Path("invoice data/payment_history.json")
+
+_PAYMENT_HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS payments (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT,
+    thread_id TEXT,
+    message_id TEXT,
+    sender TEXT,
+    subject TEXT,
+    attachment_id TEXT,
+    invoice_number TEXT,
+    paid_amount REAL,
+    recipient TEXT,
+    date TEXT,
+    due_date TEXT,
+    description TEXT,
+    success INTEGER,
+    error TEXT,
+    email_sent INTEGER,
+    payment_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_payments_message ON payments (message_id, attachment_id);
+CREATE INDEX IF NOT EXISTS idx_payments_invoice ON payments (invoice_number, recipient, date);
+"""
+
+# Row columns in insert order, after the id
+_PAYMENT_HISTORY_COLUMNS = (
+    "timestamp", "thread_id", "message_id", "sender", "subject", "attachment_id",
+    "invoice_number", "paid_amount", "recipient", "date", "due_date", "description",
+    "success", "error", "email_sent", "payment_id"
+)
+_INSERT_PAYMENT_SQL = (
+    f"INSERT INTO payments ({', '.join(_PAYMENT_HISTORY_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(_PAYMENT_HISTORY_COLUMNS))})"
 )
 
-# Enable debug mode for verbose output
-DEBUG = os.getenv("DEBUG", "false").lower() == "true"
+_history_db: Optional[sqlite3.Connection] = None
+_history_db_lock = threading.Lock()
 
-# Initialize payment tools
-balance_tool = BalanceTool()
-search_payees_tool = SearchPayeesTool()
-send_payment_tool = SendPaymentTool()
-checkout_url_tool = CheckoutUrlTool()
+# Bank details request emails; only the amount is filled in per invoice
+_BANK_DETAILS_GREETING = "Hello,\n\nWe received your invoice for {amount}. "
+_BANK_DETAILS_CLOSING = (
+    "You can reply directly to this email with the requested information.\n\n"
+    "Thank you for your cooperation.\n\n"
+    "Best regards,\n"
+    "Payman AI"
+)
+BANK_DETAILS_UPDATE_TEMPLATE = (
+    _BANK_DETAILS_GREETING +
+    "We found your payee profile in our system, but we need your bank account details "
+    "to process this payment.\n\n"
+    "Please provide:\n"
+    "1. Bank Account Number\n"
+    "2. Routing Number\n"
+    "3. Account Type (Checking/Savings)\n\n" +
+    _BANK_DETAILS_CLOSING
+)
+BANK_DETAILS_NEW_PAYEE_TEMPLATE = (
+    _BANK_DETAILS_GREETING +
+    "To process your payment, we need to set up your payee profile and collect your bank details.\n\n"
+    "Please provide:\n"
+    "1. Full Legal Name (as it appears on your bank account)\n"
+    "2. Bank Account Number\n"
+    "3. Routing Number\n"
+    "4. Account Type (Checking/Savings)\n"
+    "5. Contact Email\n"
+    "6. Contact Phone (optional)\n"
+    "7. Mailing Address\n"
+    "8. Tax ID (SSN/EIN)\n\n" +
+    _BANK_DETAILS_CLOSING
+)
+
+# Payment tools, shared with the rest of the app
+search_payees_tool = TOOLS_BY_NAME["search_payees"]
+prepare_payment_tool = TOOLS_BY_NAME["prepare_payment"]
+send_payment_tool = TOOLS_BY_NAME["send_payment"]
+checkout_url_tool = TOOLS_BY_NAME["generate_checkout_url"]
 
 # Initialize LangChain components for email
 
@@ -65,10 +135,6 @@ composio_api_key = os.getenv("COMPOSIO_API_KEY")
 if not composio_api_key:
     raise ValueError("COMPOSIO_API_KEY environment variable not found")
 
-# Initialize Composio toolset
-composio_toolset = ComposioToolSet(api_key=composio_api_key)
-tools = composio_toolset.get_tools(actions=['GMAIL_REPLY_TO_THREAD'])
-
 # Create the prompt template
 prompt = ChatPromptTemplate.from_messages([
     ("system", "You are a helpful AI assistant that processes invoice payments."),
@@ -77,49 +143,56 @@ prompt = ChatPromptTemplate.from_messages([
     MessagesPlaceholder(variable_name="agent_scratchpad")
 ])
 
-# Create the chain
-chain = (
-    RunnablePassthrough.assign(
-        chat_history=lambda x: x.get("chat_history", []),
-        agent_scratchpad=lambda x: x.get("intermediate_steps", [])
+@functools.lru_cache(maxsize=1)
+def _get_agent_executor() -> AgentExecutor:
+    """Build the email response agent on first use
+    
+    Resolving the Gmail reply tool goes over the network, so importers that
+    never send bank details emails don't pay for it.
+    
+    Returns:
+        AgentExecutor: Shared agent executor
+    """
+    # Initialize OpenAI client
+    openai_client = ChatOpenAI(
+        model="gpt-4-turbo-preview",
+        temperature=0,
+        api_key=openai_api_key
+    )
+    
+    # Resolve the reply tool through the shared Composio client so the email
+    # response agent reuses the same cached tool instead of fetching it again
+    tools = [get_composio_tool('GMAIL_REPLY_TO_THREAD')]
+    
+    # Create the chain
+    chain = (
+        RunnablePassthrough.assign(
+            chat_history=lambda x: x.get("chat_history", []),
+            agent_scratchpad=lambda x: x.get("intermediate_steps", [])
+        )
+        | prompt
+        | openai_client
+        | StrOutputParser()
+    )
+    
+    return AgentExecutor(
+        agent=chain,
+        tools=tools,
+        verbose=False,
+        tags=["invoice-agent", "email-communication"],
+        metadata={
+            "agent_type": "email_communication",
+            "agent_version": "1.0.0",
+            "environment": os.getenv("ENVIRONMENT", "production")
+        }
     )
-    | prompt
-    | openai_client
-    | StrOutputParser()
-)
-
-# Create the agent executor
-agent_executor = AgentExecutor(
-    agent=chain,
-    tools=tools,
-    verbose=False,
-    tags=["invoice-agent", "email-communication"],
-    metadata={
-        "agent_type": "email_communication",
-        "agent_version": "1.0.0",
-        "environment": os.getenv("ENVIRONMENT", "production")
-    }
-)
-
-def serialize_firebase_data(data: Any) -> Any:
-    """Serialize Firebase data types to JSON-compatible format."""
-    if isinstance(data, dict):
-        return {k: serialize_firebase_data(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [serialize_firebase_data(item) for item in data]
-    elif str(type(data)) == "<class 'google.api_core.datetime_helpers.DatetimeWithNanoseconds'>":
-        return data.isoformat()
-    elif hasattr(data, '_seconds'):  # Firebase Timestamp
-        return datetime.fromtimestamp(data._seconds).isoformat()
-    elif str(type(data)) == "<class 'google.cloud.firestore_v1.transforms.Sentinel'>":
-        return datetime.now().isoformat()
-    elif isinstance(data, datetime):
-        return data.isoformat()
-    return data
 
 def extract_payment_amount(invoice_data: Dict) -> Optional[float]:
     """Extract the final payment amount from invoice data."""
     amount = invoice_data.get('paid_amount')
+    # Numbers are the common case; check them without the exception machinery
+    if isinstance(amount, (int, float)):
+        return float(amount) if amount > 0 else None
     if amount is not None:
         try:
             amount = float(amount)
@@ -133,55 +206,32 @@ def extract_payment_amount(invoice_data: Dict) -> Optional[float]:
 def check_balance() -> float:
     """Get current balance."""
     try:
-        result = balance_tool.run("")  # Empty string as tool_input
+        # Read the balance directly rather than parsing get_balance's text
+        return get_spendable_balance()
         
-        # Extract numeric balance from string "Current balance: $X.XX"
-        if not result or "Current balance:" not in result:
-            return 0.0
-            
-        try:
-            balance_str = result.split("$")[1].strip()
-            balance = float(balance_str)
-            return balance
-        except (IndexError, ValueError) as e:
-            return 0.0
-            
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Balance check failed")
         return 0.0
 
 def search_or_create_payee(recipient_name: str) -> Optional[Dict]:
     """Search for a payee by name or create if not found."""
     try:
         # Search for existing payee
-        result = search_payees_tool.run(json.dumps({
+        payees = search_payees_tool.run_dict({
             "name": recipient_name,
             "type": "US_ACH"
-        }))
+        })
         
-        if not result:
+        if not payees:
             return None
             
-        try:
-            # Parse response
-            if isinstance(result, str):
-                payees = json.loads(result)
-            else:
-                payees = result
-                
-            if not payees:
-                return None
-                
-            # Show found payees
-            for idx, payee in enumerate(payees[:5], 1):  # Show first 5 payees
-                if payee.get('contact_email'):
-                    return payee
-            
-            # Return first matching payee
-            return payees[0]
-            
-        except json.JSONDecodeError as e:
-            return None
+        # Show found payees
+        for idx, payee in enumerate(payees[:5], 1):  # Show first 5 payees
+            if payee.get('contact_email'):
+                return payee
+        
+        # Return first matching payee
+        return payees[0]
             
     except Exception as e:
         return None
@@ -189,19 +239,10 @@ def search_or_create_payee(recipient_name: str) -> Optional[Dict]:
 def generate_checkout_url(amount: float, memo: str = "") -> Optional[str]:
     """Generate a checkout URL for adding funds."""
     try:
-        result = checkout_url_tool.run(json.dumps({
+        return checkout_url_tool.run_dict({
             "amount": amount,
             "memo": memo
-        }))
-        
-        if not result:
-            return None
-            
-        try:
-            data = json.loads(result)
-            return data.get("url")
-        except json.JSONDecodeError:
-            return None
+        })["url"]
             
     except Exception as e:
         return None
@@ -215,90 +256,167 @@ def send_payment(amount: float, payee_id: str, description: str = "") -> Optiona
             "memo": description
         }
         
-        # Convert params to JSON string for tool input
-        result = send_payment_tool.run(tool_input=json.dumps(params))
-        
-        if not result:
-            return None
-            
-        # Extract payment ID from response
-        if "Reference:" in result:
-            payment_id = result.split("Reference:")[1].strip()
-            return payment_id
-        
-        return None
+        result = send_payment_tool.run_dict(params)
+        return result.get("payment_id") if result.get("success") else None
             
     except Exception as e:
         return None
 
-def is_invoice_processed(invoice_number: str, recipient: str) -> bool:
-    """Check if an invoice has already been processed."""
-    try:
-        history_file = Path("invoice data/payment_history.json")
-        if not history_file.exists():
-            return False
+def _history_value(data: Dict, key: str):
+    """Read a payment history field, normalizing absent and empty values to None
+    
+    Rows are written and looked up through this, so a field missing from the
+    saved data is stored as NULL and matched by a lookup that also lacks it.
+    """
+    value = data.get(key)
+    return None if value == "" else value
+
+def _history_row(entry: Dict) -> tuple:
+    """Flatten a payment history entry into a payments table row"""
+    email_data = entry.get("email_data", {})
+    invoice_data = entry.get("invoice_data", {})
+    result = entry.get("result", {})
+    return (
+        entry.get("timestamp"),
+        _history_value(email_data, "thread_id"),
+        _history_value(email_data, "message_id"),
+        _history_value(email_data, "sender"),
+        _history_value(email_data, "subject"),
+        _history_value(email_data, "attachment_id"),
+        _history_value(invoice_data, "invoice_number"),
+        _history_value(invoice_data, "paid_amount"),
+        _history_value(invoice_data, "recipient"),
+        _history_value(invoice_data, "date"),
+        _history_value(invoice_data, "due_date"),
+        _history_value(invoice_data, "description"),
+        result.get("success"),
+        result.get("error"),
+        result.get("email_sent"),
+        result.get("payment_id")
+    )
+
+def _history_record(row: sqlite3.Row) -> Dict:
+    """Rebuild a payment history entry from a payments table row"""
+    # Unpack the SELECT * row positionally once instead of a name lookup per field
+    (
+        _, timestamp, thread_id, message_id, sender, subject, attachment_id,
+        invoice_number, paid_amount, recipient, date, due_date, description,
+        success, error, email_sent, payment_id
+    ) = row
+    return {
+        "timestamp": timestamp,
+        "email_data": {
+            "thread_id": thread_id,
+            "message_id": message_id,
+            "sender": sender,
+            "subject": subject,
+            "attachment_id": attachment_id
+        },
+        "invoice_data": {
+            "invoice_number": invoice_number,
+            "paid_amount": paid_amount,
+            "recipient": recipient,
+            "date": date,
+            "due_date": due_date,
+            "description": description
+        },
+        "result": {
+            "success": bool(success),
+            "error": error,
+            "email_sent": bool(email_sent),
+            "payment_id": payment_id
+        }
+    }
+
+def get_history_db() -> sqlite3.Connection:
+    """Get the payment history database, creating it on first use
+    
+    The connection is shared by all threads; hold _history_db_lock while
+    using it. On creation, records from the older JSON history file are
+    streamed into the database once.
+    
+    Returns:
+        sqlite3.Connection: Payment history database
+    """
+    global _history_db
+    
+    with _history_db_lock:
+        if _history_db is None:
+            PAYMENT_HISTORY_DB.parent.mkdir(exist_ok=True)
+            db = sqlite3.connect(PAYMENT_HISTORY_DB, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            db.executescript(_PAYMENT_HISTORY_SCHEMA)
             
-        with open(history_file, "r") as f:
-            history = json.load(f)
+            if db.execute("SELECT 1 FROM payments LIMIT 1").fetchone() is None:
+                try:
+                    with db, open(PAYMENT_HISTORY_FILE, "rb") as f:
+                        db.executemany(
+                            _INSERT_PAYMENT_SQL,
+                            (_history_row(entry) for entry in ijson.items(f, "item", use_float=True))
+                        )
+                except FileNotFoundError:
+                    pass
             
-        for payment in history:
-            invoice_data = payment.get("invoice_data", {})
-            result = payment.get("result", {})
-            if (invoice_data.get("invoice_number") == invoice_number and 
-                invoice_data.get("recipient") == recipient and 
-                result.get("success")):
-                return True
-                
-        return False
+            _history_db = db
+    return _history_db
+
+def _find_history_records(db: sqlite3.Connection, invoice_data: Dict, email_data: Dict) -> tuple:
+    """Find the first history rows matching an email attachment and an invoice
+    
+    Args:
+        db (sqlite3.Connection): Payment history database
+        invoice_data (dict): Invoice details
+        email_data (dict): Email details
         
-    except Exception as e:
-        return False
+    Returns:
+        tuple: (row for the same message and attachment, row for the same
+            invoice number, date, amount and recipient), each None if absent;
+            successful payments are preferred over failed attempts
+    """
+    # Without a message ID there is no email to match; entries saved without
+    # one all share the same empty ID
+    exact = None
+    message_id = _history_value(email_data, "message_id")
+    if message_id is not None:
+        # IS compares like ==, including None, and still uses the indexes
+        exact = db.execute(
+            "SELECT * FROM payments WHERE message_id IS ? AND attachment_id IS ? "
+            "ORDER BY success DESC, id LIMIT 1",
+            (message_id, _history_value(email_data, "attachment_id"))
+        ).fetchone()
+    similar = db.execute(
+        "SELECT * FROM payments WHERE invoice_number IS ? AND recipient IS ? AND date IS ? "
+        "AND paid_amount IS ? ORDER BY success DESC, id LIMIT 1",
+        (
+            _history_value(invoice_data, "invoice_number"),
+            _history_value(invoice_data, "recipient"),
+            _history_value(invoice_data, "date"),
+            _history_value(invoice_data, "paid_amount")
+        )
+    ).fetchone()
+    return exact, similar
 
 def save_payment_history(email_data: Dict, invoice_data: Dict, result: Dict):
     """Save payment attempt to history if not already present."""
     try:
-        history_dir = Path("invoice data")
-        history_dir.mkdir(exist_ok=True)
-        history_file = history_dir / "payment_history.json"
-        
-        # Load existing history
-        history = []
-        if history_file.exists():
-            try:
-                with open(history_file, "r") as f:
-                    history = json.load(f)
-            except json.JSONDecodeError:
-                history = []
-                
-        # Check if this invoice is already in history
-        for entry in history:
-            if (entry["email_data"].get("message_id") == email_data.get("message_id") and
-                entry["email_data"].get("attachment_id") == email_data.get("attachment_id")):
-                return
-                
-            if (entry["invoice_data"].get("invoice_number") == invoice_data.get("invoice_number") and
-                entry["invoice_data"].get("date") == invoice_data.get("date") and
-                entry["invoice_data"].get("paid_amount") == invoice_data.get("paid_amount") and
-                entry["invoice_data"].get("recipient") == invoice_data.get("recipient")):
-                return
-                
-        # Format the entry with consistent structure
+        # Format the entry with consistent structure; absent fields are
+        # stored as NULL (see _history_value)
         entry = {
             "timestamp": datetime.now().isoformat(),
             "email_data": {
-                "thread_id": email_data.get("thread_id", ""),
-                "message_id": email_data.get("message_id", ""),
-                "sender": email_data.get("sender", ""),
-                "subject": email_data.get("subject", ""),
-                "attachment_id": email_data.get("attachment_id", "")
+                "thread_id": email_data.get("thread_id"),
+                "message_id": email_data.get("message_id"),
+                "sender": email_data.get("sender"),
+                "subject": email_data.get("subject"),
+                "attachment_id": email_data.get("attachment_id")
             },
             "invoice_data": {
-                "invoice_number": invoice_data.get("invoice_number", ""),
-                "paid_amount": invoice_data.get("paid_amount", 0.0),
-                "recipient": invoice_data.get("recipient", ""),
-                "date": invoice_data.get("date", ""),
-                "due_date": invoice_data.get("due_date", ""),
-                "description": invoice_data.get("description", "")
+                "invoice_number": invoice_data.get("invoice_number"),
+                "paid_amount": invoice_data.get("paid_amount"),
+                "recipient": invoice_data.get("recipient"),
+                "date": invoice_data.get("date"),
+                "due_date": invoice_data.get("due_date"),
+                "description": invoice_data.get("description")
             },
             "result": {
                 "success": result.get("success", False),
@@ -308,15 +426,21 @@ def save_payment_history(email_data: Dict, invoice_data: Dict, result: Dict):
             }
         }
         
-        # Add new record only if not already present
-        history.append(entry)
-        
-        # Save updated history
-        with open(history_file, "w") as f:
-            json.dump(history, f, indent=2)
+        db = get_history_db()
+        with _history_db_lock, db:
+            # Add new record only if this invoice is not already in history;
+            # a success is still recorded after earlier failed attempts
+            matches = [row for row in _find_history_records(db, invoice_data, email_data) if row]
+            if matches and (not entry["result"]["success"] or any(row["success"] for row in matches)):
+                return
+            
+            db.execute(
+                _INSERT_PAYMENT_SQL,
+                _history_row(entry)
+            )
             
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Failed to save payment history")
 
 async def send_bank_details_request(
     thread_id: str,
@@ -340,40 +464,8 @@ async def send_bank_details_request(
             }
             
         # Prepare email message
-        message = (
-            f"Hello,\n\n"
-            f"We received your invoice for {format_currency(amount)}. "
-        )
-        
-        if payee_exists:
-            message += (
-                "We found your payee profile in our system, but we need your bank account details "
-                "to process this payment.\n\n"
-                "Please provide:\n"
-                "1. Bank Account Number\n"
-                "2. Routing Number\n"
-                "3. Account Type (Checking/Savings)\n\n"
-            )
-        else:
-            message += (
-                "To process your payment, we need to set up your payee profile and collect your bank details.\n\n"
-                "Please provide:\n"
-                "1. Full Legal Name (as it appears on your bank account)\n"
-                "2. Bank Account Number\n"
-                "3. Routing Number\n"
-                "4. Account Type (Checking/Savings)\n"
-                "5. Contact Email\n"
-                "6. Contact Phone (optional)\n"
-                "7. Mailing Address\n"
-                "8. Tax ID (SSN/EIN)\n\n"
-            )
-            
-        message += (
-            "You can reply directly to this email with the requested information.\n\n"
-            "Thank you for your cooperation.\n\n"
-            "Best regards,\n"
-            "Payman AI"
-        )
+        template = BANK_DETAILS_UPDATE_TEMPLATE if payee_exists else BANK_DETAILS_NEW_PAYEE_TEMPLATE
+        message = template.format(amount=format_currency(amount))
         
         # Format task for LangChain agent
         task = {
@@ -385,10 +477,18 @@ async def send_bank_details_request(
         }
         
         # Execute agent with task
-        result = await agent_executor.arun(
-            json.dumps(task)
+        result = await _get_agent_executor().arun(
+            orjson.dumps(task).decode()
         )
         
+        # The agent replies in text; pick out the JSON status it reports
+        if isinstance(result, str):
+            span = find_json_span(result)
+            try:
+                result = orjson.loads(result[span[0]:span[1]]) if span else None
+            except orjson.JSONDecodeError:
+                result = None
+        
         # Check if email was sent successfully
         success = (
             isinstance(result, dict) and
@@ -419,131 +519,251 @@ async def send_bank_details_request(
             "recipient": recipient
         }
 
-def is_duplicate_invoice(invoice_data: Dict, email_data: Dict) -> Optional[Dict]:
-    """Check if invoice has already been processed or attempted.
-    Returns None if no duplicate found or if invoice was already processed successfully."""
+def check_history(invoice_data: Dict, email_data: Dict) -> Dict:
+    """Look up an invoice in the payment history with a single check
+    
+    Args:
+        invoice_data (dict): Invoice details
+        email_data (dict): Email details
+        
+    Returns:
+        dict: {"status": ..., "record": ...} where status is "processed" if
+            the invoice was already paid, "duplicate" if an earlier attempt
+            failed (record holds that attempt), "none" if it is new, or
+            "error" if the history could not be read
+    """
     try:
-        history_file = Path("invoice data/payment_history.json")
-        if not history_file.exists():
-            return None
-            
-        with open(history_file, "r") as f:
-            history = json.load(f)
+        db = get_history_db()
+        with _history_db_lock:
+            exact, similar = _find_history_records(db, invoice_data, email_data)
             
-        # Check for exact matches first
-        for record in history:
-            if (record["email_data"].get("message_id") == email_data.get("message_id") and
-                record["email_data"].get("attachment_id") == email_data.get("attachment_id")):
-                if record["result"].get("success") or record["result"].get("error") == "Invoice already processed":
-                    return None
-                return record
-                
-        # Check for similar invoices (same number, date, amount)
-        for record in history:
-            if (record["invoice_data"].get("invoice_number") == invoice_data.get("invoice_number") and
-                record["invoice_data"].get("date") == invoice_data.get("date") and
-                record["invoice_data"].get("paid_amount") == invoice_data.get("paid_amount") and
-                record["invoice_data"].get("recipient") == invoice_data.get("recipient")):
-                if record["result"].get("success") or record["result"].get("error") == "Invoice already processed":
-                    return None
-                return record
-                
-        return None
+            # Exact matches take priority over similar invoices (same number, date, amount)
+            record = exact or similar
+            invoice_number = _history_value(invoice_data, "invoice_number")
+            if record is None and invoice_number is not None:
+                # A successful payment of the same invoice to the same
+                # recipient also counts, whatever its date or amount
+                record = db.execute(
+                    "SELECT * FROM payments WHERE invoice_number IS ? AND recipient IS ? AND success LIMIT 1",
+                    (invoice_number, _history_value(invoice_data, "recipient"))
+                ).fetchone()
+        
+        if record is None:
+            return {"status": "none", "record": None}
+        if record["success"] or record["error"] == "Invoice already processed":
+            return {"status": "processed", "record": _history_record(record)}
+        return {"status": "duplicate", "record": _history_record(record)}
         
     except Exception as e:
-        return None
+        # Fail closed: an unreadable history must not look like a new invoice
+        logger.exception("Failed to check payment history")
+        return {"status": "error", "record": None, "error": str(e)}
 
-async def process_payment(payment_data: Dict) -> Dict:
-    """Process a payment using the payment tools."""
-    try:
-        # 1. Search for payee
-        search_result = search_payees_tool.run(json.dumps({
-            "name": payment_data.get("recipient"),
-            "type": "US_ACH"
-        }))
-        
-        if not search_result:
-            return {
-                "success": False,
-                "error": "Payee not found",
-                "error_type": "PayeeNotFound"
-            }
-        
-        try:
-            payees = json.loads(search_result) if isinstance(search_result, str) else search_result
-        except json.JSONDecodeError:
-            return {
-                "success": False,
-                "error": "Invalid payee search response",
-                "error_type": "InvalidResponse"
-            }
-        
-        if not payees:
-            return {
-                "success": False,
-                "error": "No matching payee found",
-                "error_type": "PayeeNotFound"
-            }
-        
-        payee = payees[0]
-        payee_id = payee.get("id")
+async def acheck_history(invoice_data: Dict, email_data: Dict) -> Dict:
+    """Async version of check_history that keeps the event loop free
+    
+    Args:
+        invoice_data (dict): Invoice details
+        email_data (dict): Email details
         
-        if not payee_id:
-            return {
-                "success": False,
-                "error": "Invalid payee data - missing ID",
-                "error_type": "InvalidPayeeData"
-            }
+    Returns:
+        dict: {"status": ..., "record": ...}, as returned by check_history
+    """
+    return await asyncio.to_thread(check_history, invoice_data, email_data)
+
+def _insufficient_funds(amount: float, balance: float) -> Dict:
+    """Build the failed result for a payment larger than the balance"""
+    return {
+        "success": False,
+        "error": f"Insufficient funds. Required: {format_currency(amount)}, Available: {format_currency(balance)}",
+        "error_type": "InsufficientFunds"
+    }
+
+async def _pay_payee(payment_data: Dict, amount: float, payees: List[Dict]) -> Dict:
+    """Send a payment to the first payee found for its recipient
+    
+    Args:
+        payment_data (dict): Payment details (invoice_number, description)
+        amount (float): Amount to send
+        payees (list): Payee search results for the recipient
         
-        # 2. Send payment
-        payment_params = {
-            "amount": float(payment_data.get("amount", 0)),
-            "destination_id": payee_id,
-            "memo": payment_data.get("description", "")
+    Returns:
+        dict: Payment result
+    """
+    if not payees:
+        return {
+            "success": False,
+            "error": "No matching payee found",
+            "error_type": "PayeeNotFound"
         }
+    
+    payee = payees[0]
+    payee_id = payee.get("id")
+    
+    if not payee_id:
+        return {
+            "success": False,
+            "error": "Invalid payee data - missing ID",
+            "error_type": "InvalidPayeeData"
+        }
+    
+    # Send payment
+    payment_params = {
+        "amount": amount,
+        "destination_id": payee_id,
+        "memo": payment_data.get("description", "")
+    }
+    
+    result = await asyncio.to_thread(send_payment_tool.run_dict, payment_params)
+    
+    if not result.get("success"):
+        return {
+            "success": False,
+            "error": result.get("error", "Payment failed"),
+            "error_type": result.get("error_type", "PaymentFailed"),
+            "details": result.get("details", {})
+        }
+    
+    return {
+        "success": True,
+        "payment_id": result.get("payment_id"),
+        "status": result.get("status", "completed"),
+        "payment_method": result.get("payment_method", "existing_payee"),
+        "external_reference": result.get("external_reference"),
+        "invoice_number": payment_data.get("invoice_number"),
+        "details": result.get("details", {})
+    }
+
+async def process_payment(payment_data: Dict, prepared: Optional[Dict] = None) -> Dict:
+    """Process a payment using the payment tools.
+    
+    Args:
+        payment_data (dict): Payment details (recipient, amount, description)
+        prepared (dict, optional): prepare_payment result ({"balance", "payees"})
+            the caller already fetched for this recipient; fetched here if omitted
         
-        payment_result = send_payment_tool.run(json.dumps(payment_params))
-        
-        if not payment_result:
-            return {
-                "success": False,
-                "error": "Payment failed - no response",
-                "error_type": "PaymentFailed"
-            }
+    Returns:
+        dict: Payment result
+    """
+    try:
+        # 1. Check the balance and search for the payee; prepare_payment runs
+        # both Payman calls concurrently, off the event loop
+        if prepared is None:
+            prepared = await asyncio.to_thread(prepare_payment_tool.run_dict, {
+                "name": payment_data.get("recipient"),
+                "type": "US_ACH"
+            })
         
-        try:
-            result = json.loads(payment_result)
-        except json.JSONDecodeError:
-            return {
-                "success": False,
-                "error": "Invalid payment response",
-                "error_type": "InvalidResponse"
-            }
+        amount = float(payment_data.get("amount", 0))
+        if prepared["balance"] < amount:
+            return _insufficient_funds(amount, prepared["balance"])
         
-        if not result.get("success"):
-            return {
-                "success": False,
-                "error": result.get("error", "Payment failed"),
-                "error_type": result.get("error_type", "PaymentFailed"),
-                "details": result.get("details", {})
-            }
+        return await _pay_payee(payment_data, amount, prepared["payees"])
         
+    except Exception as e:
         return {
-            "success": True,
-            "payment_id": result.get("payment_id"),
-            "status": result.get("status", "completed"),
-            "payment_method": result.get("payment_method", "existing_payee"),
-            "external_reference": result.get("external_reference"),
-            "invoice_number": payment_data.get("invoice_number"),
-            "details": result.get("details", {})
+            "success": False,
+            "error": str(e),
+            "error_type": type(e).__name__
         }
+
+async def process_payments_bulk(payments: List[Dict], concurrency: int = 8) -> List[Dict]:
+    """Process several payments concurrently
+    
+    The balance is fetched once for the whole batch and each payment's amount
+    is reserved from it before sending, so concurrent payments can't overdraw
+    it. Payee searches and sends still overlap their round-trips.
+    
+    Each payment is looked up in the payment history first. Invoices already
+    paid, or repeated within the batch, are skipped; every attempt made is
+    recorded with save_payment_history.
+    
+    Args:
+        payments (list): Payment data dictionaries, as accepted by
+            process_payment; an optional "email_data" entry identifies the
+            email the invoice came from
+        concurrency (int): Maximum number of payments in flight at once
         
+    Returns:
+        list: process_payment results, in the order of payments
+    """
+    try:
+        remaining = await asyncio.to_thread(get_spendable_balance)
     except Exception as e:
-        return {
+        return [{
             "success": False,
             "error": str(e),
             "error_type": type(e).__name__
-        }
+        } for _ in payments]
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    # Duplicate-check keys of the invoices this batch has claimed
+    claimed = set()
+    
+    async def pay(payment_data: Dict) -> Dict:
+        nonlocal remaining
+        payees = await asyncio.to_thread(search_payees_tool.run_dict, {
+            "name": payment_data.get("recipient"),
+            "type": "US_ACH"
+        })
+        
+        # No await between the check and the reservation, so the two
+        # can't interleave with another payment's
+        amount = float(payment_data.get("amount", 0))
+        if remaining < amount:
+            return _insufficient_funds(amount, remaining)
+        remaining -= amount
+        
+        result = None
+        try:
+            result = await _pay_payee(payment_data, amount, payees)
+            return result
+        finally:
+            if not (result and result["success"]):
+                remaining += amount
+    
+    async def process(payment_data: Dict) -> Dict:
+        email_data = payment_data.get("email_data", {})
+        async with semaphore:
+            history = await acheck_history(payment_data, email_data)
+            if history["status"] == "error":
+                return {
+                    "success": False,
+                    "error": history["error"],
+                    "error_type": "HistoryUnavailable"
+                }
+            if history["status"] == "processed":
+                return {
+                    "success": False,
+                    "error": "Invoice already processed",
+                    "error_type": "AlreadyProcessed"
+                }
+            
+            key = tuple(
+                _history_value(payment_data, field)
+                for field in ("invoice_number", "recipient", "date", "paid_amount")
+            )
+            if key in claimed:
+                return {
+                    "success": False,
+                    "error": "Invoice appears more than once in the batch",
+                    "error_type": "DuplicateInBatch"
+                }
+            claimed.add(key)
+            
+            result = await pay(payment_data)
+            await asyncio.to_thread(save_payment_history, email_data, payment_data, result)
+            return result
+    
+    results = await asyncio.gather(
+        *(process(payment_data) for payment_data in payments),
+        return_exceptions=True
+    )
+    return [
+        {"success": False, "error": str(r), "error_type": type(r).__name__}
+        if isinstance(r, BaseException) else r
+        for r in results
+    ]
 
 def main():
     """Example usage of payment agent"""
@@ -563,9 +783,18 @@ def main():
             "balance_due": 5872.50  # Final amount to pay
         }
         
-        # Process payment using agent
-        result = process_payment(invoice_data)
-        return result
+        # Dry run: show what would be paid without sending money
+        search_params = {"name": invoice_data["recipient"], "type": "US_ACH"}
+        prepared = prepare_payment_tool.run_dict(search_params)
+        plan = {
+            "invoice_number": invoice_data["invoice_number"],
+            "amount": extract_payment_amount(invoice_data),
+            "history": check_history(invoice_data, {})["status"],
+            "balance": prepared["balance"],
+            "payee_found": bool(prepared["payees"])
+        }
+        logger.info("Dry run payment plan: %s", plan)
+        return plan
                 
     except Exception as e:
         return {
@@ -575,4 +804,5 @@ def main():
         }
 
 if __name__ == "__main__":
+    configure_logging()
     main() 
\ No newline at end of file
@@ -1,10 +1,21 @@
 """PDF agent for extracting and processing text from PDF files."""
 
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 from pathlib import Path
+import hashlib
+import mmap
 import os
-from langchain_community.document_loaders import PyPDFLoader
-import json
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait
+)
+import orjson
 import traceback
 import re
 from datetime import datetime
@@ -13,22 +24,49 @@ from langchain_core.messages import SystemMessage, HumanMessage
 
 from tools.shared_tools import (
     debug_print,
+    ensure_directory,
     format_error,
     get_openai_client
 )
 
-class PaymentExtractor:
-    """Extract and validate payment information from invoices."""
+# Maximum number of PDFs extracted concurrently by extract_from_directory
+MAX_EXTRACTION_WORKERS = min(8, (os.cpu_count() or 1) + 4)
+
+# poppler's pdftotext is much faster than the pure-Python parser; use it when installed
+PDFTOTEXT_PATH = shutil.which("pdftotext")
+
+# Extraction results are cached by PDF content so re-running a directory or
+# retrying a failed payment skips the LLM for invoices already extracted
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", ".cache/extractions")
+EXTRACTION_CACHE_TTL = int(os.getenv("EXTRACTION_CACHE_TTL", 86400))
+
+# Invoice fields sit in the header and the totals block, so very long texts
+# are trimmed to their head and tail before being sent to the LLM
+MAX_EXTRACTION_CHARS = int(os.getenv("MAX_EXTRACTION_CHARS", 16000))
+_HORIZONTAL_SPACE_RE = re.compile(r"[ \t\xa0]{2,}")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+
+def compact_invoice_text(text: str, max_chars: int = MAX_EXTRACTION_CHARS) -> str:
+    """Strip layout padding from invoice text and cap its length.
     
-    def __init__(self):
-        """Initialize payment extractor."""
-        self.llm = get_openai_client()
+    Args:
+        text (str): Text extracted from the PDF
+        max_chars (int): Maximum number of characters to keep
+        
+    Returns:
+        str: Compacted text
+    """
+    text = _HORIZONTAL_SPACE_RE.sub("  ", text)
+    text = _BLANK_LINES_RE.sub("\n\n", text).strip()
+    if len(text) <= max_chars:
+        return text
     
-    def extract(self, text: str) -> dict:
-        """Extract payment details from invoice text."""
-        try:
-            messages = [
-                SystemMessage(content="""Extract payment details from invoices with high precision.
+    head = max_chars * 3 // 4
+    tail = max_chars - head
+    return text[:head] + "\n...\n" + text[-tail:]
+
+# Instructions and function schema for the extractor, built once at import
+EXTRACTION_SYSTEM_MESSAGE = SystemMessage(content="""Extract payment details from invoices with high precision.
                 
                 Rules:
                 1. Only extract explicitly stated information
@@ -48,81 +86,94 @@ class PaymentExtractor:
                    - Full address
                    - Tax ID if available
                 8. Use payment section for payee details
-                9. Use "BILLED TO" section for customer details"""),
-                HumanMessage(content=f"Extract payment details from this invoice:\n{text}")
-            ]
-            
-            functions = [{
-                "name": "extract_payment_details",
-                "description": "Extract payment details from invoice text",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "payee": {
-                            "type": "object",
-                            "properties": {
-                                "name": {"type": "string"},
-                                "contact_type": {"type": "string", "enum": ["individual", "business"]},
-                                "email": {"type": "string"},
-                                "phone": {"type": "string"},
-                                "address": {"type": "string"},
-                                "tax_id": {"type": "string"}
-                            },
-                            "required": ["name", "contact_type"]
-                        },
-                        "bank_details": {
-                            "type": "object",
-                            "properties": {
-                                "type": {"type": "string", "enum": ["US_ACH"], "default": "US_ACH"},
-                                "account_holder_name": {"type": "string"},
-                                "account_number": {"type": "string"},
-                                "account_type": {"type": "string", "enum": ["checking", "savings"]},
-                                "routing_number": {"type": "string"},
-                                "bank_name": {"type": "string"}
-                            }
-                        },
-                        "payment": {
-                            "type": "object",
-                            "properties": {
-                                "amount": {"type": "number"},
-                                "currency": {"type": "string", "default": "USD"},
-                                "description": {"type": "string"}
-                            },
-                            "required": ["amount"]
-                        },
-                        "invoice": {
-                            "type": "object",
-                            "properties": {
-                                "number": {"type": "string"},
-                                "date": {"type": "string", "format": "date"},
-                                "due_date": {"type": "string", "format": "date"}
-                            },
-                            "required": ["number"]
-                        },
-                        "customer": {
-                            "type": "object",
-                            "properties": {
-                                "name": {"type": "string"},
-                                "email": {"type": "string"},
-                                "phone": {"type": "string"},
-                                "address": {"type": "string"}
-                            }
-                        }
-                    },
-                    "required": ["payee", "payment", "invoice"]
+                9. Use "BILLED TO" section for customer details""")
+
+PAYMENT_EXTRACTION_FUNCTIONS = [{
+    "name": "extract_payment_details",
+    "description": "Extract payment details from invoice text",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "payee": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "contact_type": {"type": "string", "enum": ["individual", "business"]},
+                    "email": {"type": "string"},
+                    "phone": {"type": "string"},
+                    "address": {"type": "string"},
+                    "tax_id": {"type": "string"}
+                },
+                "required": ["name", "contact_type"]
+            },
+            "bank_details": {
+                "type": "object",
+                "properties": {
+                    "type": {"type": "string", "enum": ["US_ACH"], "default": "US_ACH"},
+                    "account_holder_name": {"type": "string"},
+                    "account_number": {"type": "string"},
+                    "account_type": {"type": "string", "enum": ["checking", "savings"]},
+                    "routing_number": {"type": "string"},
+                    "bank_name": {"type": "string"}
                 }
-            }]
+            },
+            "payment": {
+                "type": "object",
+                "properties": {
+                    "amount": {"type": "number"},
+                    "currency": {"type": "string", "default": "USD"},
+                    "description": {"type": "string"}
+                },
+                "required": ["amount"]
+            },
+            "invoice": {
+                "type": "object",
+                "properties": {
+                    "number": {"type": "string"},
+                    "date": {"type": "string", "format": "date"},
+                    "due_date": {"type": "string", "format": "date"}
+                },
+                "required": ["number"]
+            },
+            "customer": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "email": {"type": "string"},
+                    "phone": {"type": "string"},
+                    "address": {"type": "string"}
+                }
+            }
+        },
+        "required": ["payee", "payment", "invoice"]
+    }
+}]
+
+class PaymentExtractor:
+    """Extract and validate payment information from invoices."""
+    
+    def __init__(self):
+        """Initialize payment extractor."""
+        self.llm = get_openai_client()
+    
+    def extract(self, text: str) -> dict:
+        """Extract payment details from invoice text."""
+        try:
+            messages = [
+                EXTRACTION_SYSTEM_MESSAGE,
+                HumanMessage(content=f"Extract payment details from this invoice:\n{compact_invoice_text(text)}")
+            ]
             
             response = self.llm.invoke(
                 messages,
-                functions=functions,
+                functions=PAYMENT_EXTRACTION_FUNCTIONS,
                 function_call={"name": "extract_payment_details"}
             )
             
             if hasattr(response, 'additional_kwargs') and 'function_call' in response.additional_kwargs:
                 func_call = response.additional_kwargs['function_call']
                 if func_call and 'arguments' in func_call:
-                    extracted = json.loads(func_call['arguments'])
+                    extracted = orjson.loads(func_call['arguments'])
                     
                     # Convert to our standard format
                     return {
@@ -148,57 +199,245 @@ class PaymentExtractor:
         except Exception as e:
             return {"error": f"Extraction failed: {str(e)}"}
 
-def extract_text(pdf_path: str, extract_metadata: bool = True) -> Dict:
-    """Extract text from a PDF file"""
+# PDF readers accept the header anywhere in the first kilobyte
+PDF_SIGNATURE = b"%PDF-"
+PDF_SIGNATURE_WINDOW = 1024
+
+def has_pdf_signature(pdf_path: str) -> bool:
+    """Check whether a file starts like a PDF before handing it to a parser.
+    
+    Args:
+        pdf_path (str): Path to the file
+        
+    Returns:
+        bool: True if the PDF header is present
+    """
+    with open(pdf_path, "rb") as f:
+        return PDF_SIGNATURE in f.read(PDF_SIGNATURE_WINDOW)
+
+def iter_pdf_page_texts(pdf_path: str) -> Iterator[str]:
+    """Iterate over the text of each page of a PDF file.
+    
+    Uses pdftotext when it is available and falls back to pypdf if the
+    binary is missing or fails on the file. Pages are yielded one at a time so
+    callers never hold every page of a large PDF at once, and only the text is
+    kept, without a per-page document and metadata dict.
+    
+    Args:
+        pdf_path (str): Path to the PDF file
+        
+    Yields:
+        str: Text of each page, in page order
+    """
+    if PDFTOTEXT_PATH:
+        result = subprocess.run(
+            [PDFTOTEXT_PATH, "-layout", "-enc", "UTF-8", pdf_path, "-"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        if result.returncode == 0:
+            # pdftotext ends every page with a form feed
+            page_texts = result.stdout.decode("utf-8", errors="replace").split("\f")
+            # Drop the empty tail after the last form feed; isspace() checks
+            # it in place where strip() would copy the page text
+            last_page = page_texts[-1]
+            if not last_page or last_page.isspace():
+                page_texts.pop()
+            yield from page_texts
+            return
+    
+    # Imported here so the pypdf stack only loads when pdftotext is missing
+    from pypdf import PdfReader
+    
+    # Map the file instead of reading it so only the objects pypdf resolves
+    # are paged in; the reader seeks on the map directly, without a copy
+    with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for page in PdfReader(mm).pages:
+            yield page.extract_text() or ""
+
+def read_pdf_text(pdf_path: str) -> Dict:
+    """Read the combined text of a PDF file.
+    
+    Module-level and returning plain data so it can run in a worker process.
+    
+    Args:
+        pdf_path (str): Path to the PDF file
+        
+    Returns:
+        dict: {"success": True, "text": ...} or an error result
+    """
     try:
-        # Check if file exists
-        if not os.path.exists(pdf_path):
+        # Opening the file doubles as the existence check; renamed or
+        # corrupted downloads fail here instead of deep in the parser
+        try:
+            is_pdf = has_pdf_signature(pdf_path)
+        except FileNotFoundError:
             return {
                 "success": False,
                 "error": f"PDF file not found: {pdf_path}"
             }
         
-        # Load and process PDF
-        loader = PyPDFLoader(pdf_path)
-        pages = loader.load()
-        
-        # Process pages
-        processed_pages = []
-        combined_text = ""
-        
-        for page in pages:
-            page_data = {
-                "page_number": page.metadata.get("page", 0) + 1,
-                "text_length": len(page.page_content)
+        if not is_pdf:
+            return {
+                "success": False,
+                "error": f"Not a PDF file: {pdf_path}"
             }
-            if extract_metadata:
-                page_data["metadata"] = page.metadata
-            processed_pages.append(page_data)
-            combined_text += page.page_content + "\n"
         
-        # Extract payment information
-        extractor = PaymentExtractor()
-        payment_info = extractor.extract(combined_text)
+        # Stream pages straight into the combined text instead of keeping
+        # every page document alive for the whole extraction
+        combined_text = "".join(
+            text + "\n" for text in iter_pdf_page_texts(pdf_path)
+        )
+        return {"success": True, "text": combined_text}
         
-        if "error" in payment_info:
-            return payment_info
-            
-        return payment_info
-            
     except Exception as e:
         return {"error": str(e)}
 
+def extract_payment_info(text: str) -> Dict:
+    """Extract payment information from invoice text"""
+    try:
+        extractor = PaymentExtractor()
+        return extractor.extract(text)
+    except Exception as e:
+        return {"error": str(e)}
+
+def extraction_cache_key(pdf_path: str) -> Optional[str]:
+    """Get the extraction cache key for a PDF from a hash of its content
+    
+    Args:
+        pdf_path (str): Path to the PDF file
+        
+    Returns:
+        str: Cache key, or None if the file can't be read
+    """
+    try:
+        with open(pdf_path, "rb") as f:
+            return hashlib.file_digest(f, "sha1").hexdigest()
+    except OSError:
+        return None
+
+def load_cached_extraction(key: Optional[str]) -> Optional[Dict]:
+    """Return an earlier extraction result if it hasn't expired
+    
+    Args:
+        key (str): Cache key from extraction_cache_key
+        
+    Returns:
+        dict: Cached extraction result, or None if it must be extracted
+    """
+    if key is None:
+        return None
+    
+    try:
+        with open(Path(EXTRACTION_CACHE_DIR) / f"{key}.json", "rb") as f:
+            if time.time() - os.fstat(f.fileno()).st_mtime > EXTRACTION_CACHE_TTL:
+                return None
+            return orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+
+def store_cached_extraction(key: Optional[str], result: Dict) -> None:
+    """Record a successful extraction so later runs can skip it
+    
+    Args:
+        key (str): Cache key from extraction_cache_key
+        result (dict): Extraction result to record
+    """
+    if key is None or "error" in result:
+        return
+    
+    cache_path = ensure_directory(EXTRACTION_CACHE_DIR) / f"{key}.json"
+    tmp_path = cache_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        tmp_path.write_bytes(orjson.dumps(result, default=str))
+        # Atomic so concurrent readers never see a partial record
+        os.replace(tmp_path, cache_path)
+    except (OSError, TypeError):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def extract_text(pdf_path: str) -> Dict:
+    """Extract text from a PDF file"""
+    cache_key = extraction_cache_key(pdf_path)
+    cached = load_cached_extraction(cache_key)
+    if cached is not None:
+        return cached
+    
+    pdf_text = read_pdf_text(pdf_path)
+    if "error" in pdf_text:
+        return pdf_text
+    
+    # Extract payment information
+    result = extract_payment_info(pdf_text["text"])
+    store_cached_extraction(cache_key, result)
+    return result
+
+def iter_extractions(pdf_paths: List[str]) -> Iterator[Tuple[int, Dict]]:
+    """Extract payment details from several PDFs, yielding each as it finishes
+    
+    Each PDF is parsed and sent to the LLM independently, so extractions run
+    concurrently. Without pdftotext, parsing is pure Python and holds the GIL,
+    so it is spread over worker processes while the LLM calls stay on
+    threads. Callers can start paying the first invoices while the rest are
+    still being extracted, and PDFs with a cached result are yielded first.
+    
+    Args:
+        pdf_paths (list): Paths of the PDFs to extract
+        
+    Yields:
+        tuple: (index into pdf_paths, extract_text result) in completion order
+    """
+    llm_executor = ThreadPoolExecutor(max_workers=MAX_EXTRACTION_WORKERS)
+    if PDFTOTEXT_PATH or len(pdf_paths) < 2:
+        parse_executor = llm_executor
+    else:
+        parse_executor = ProcessPoolExecutor(
+            max_workers=min(len(pdf_paths), os.cpu_count() or 1)
+        )
+    
+    try:
+        pending = {}
+        for index, pdf_path in enumerate(pdf_paths):
+            cache_key = extraction_cache_key(str(pdf_path))
+            cached = load_cached_extraction(cache_key)
+            if cached is not None:
+                yield index, cached
+                continue
+            pending[parse_executor.submit(read_pdf_text, str(pdf_path))] = (index, cache_key, True)
+        
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, cache_key, is_parse = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"error": str(e)}
+                
+                if is_parse and "error" not in result:
+                    # Hand the text to the LLM as soon as the PDF is parsed
+                    pending[llm_executor.submit(extract_payment_info, result["text"])] = (index, cache_key, False)
+                else:
+                    if not is_parse:
+                        store_cached_extraction(cache_key, result)
+                    yield index, result
+    finally:
+        # Don't start extractions the caller no longer wants
+        if parse_executor is not llm_executor:
+            parse_executor.shutdown(wait=True, cancel_futures=True)
+        llm_executor.shutdown(wait=True, cancel_futures=True)
+
 def extract_from_directory(
     directory: str,
-    file_pattern: str = "*.pdf",
-    extract_metadata: bool = True
+    file_pattern: str = "*.pdf"
 ) -> Dict:
     """Extract text from all PDFs in a directory
     
     Args:
         directory (str): Directory containing PDFs
         file_pattern (str): Pattern to match PDF files
-        extract_metadata (bool): Whether to extract metadata
         
     Returns:
         dict: Results for each PDF
@@ -221,17 +460,13 @@ def extract_from_directory(
                 "message": f"No PDF files found in {directory}"
             }
         
-        # Process each PDF
-        results = []
-        for pdf_file in pdf_files:
-            result = extract_text(
-                pdf_path=str(pdf_file),
-                extract_metadata=extract_metadata
-            )
-            results.append(result)
+        # Store each result at its original index as extractions finish
+        results = [None] * len(pdf_files)
+        for index, result in iter_extractions(pdf_files):
+            results[index] = result
         
-        successful = [r for r in results if r["success"]]
-        failed = [r for r in results if not r["success"]]
+        successful = [r for r in results if "error" not in r]
+        failed = [r for r in results if "error" in r]
         
         return {
             "success": True,
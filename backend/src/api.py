@@ -5,7 +5,7 @@ from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import os
-import json
+import asyncio
 from datetime import datetime, timedelta
 import re
 from pathlib import Path
@@ -14,12 +14,28 @@ from dotenv import load_dotenv
 
 from auth.auth import jwt_auth
 from agents.pdf_agent import extract_text
-from agents.payment_agent import process_payment
-from tools.payment_tools import BalanceTool, SearchPayeesTool, SendPaymentTool, CheckoutUrlTool
+from agents.payment_agent import (
+    acheck_history,
+    extract_payment_amount,
+    process_payment,
+    save_payment_history
+)
+from tools.payment_tools import TOOLS_BY_NAME
+from tools.shared_tools import (
+    DEBUG,
+    configure_logging,
+    dump_debug_json,
+    ensure_directory,
+    format_currency,
+    serialize_firebase_data
+)
 
 # Load environment variables and validate
 load_dotenv()
 
+# The API server is an entry point, so it owns the logging setup
+configure_logging()
+
 # Validate required environment variables
 required_env_vars = [
     "OPENAI_API_KEY",
@@ -58,31 +74,40 @@ app.add_middleware(
     allow_headers=["*"],
         )
 
+# Characters that are not allowed in downloaded invoice file names
+UNSAFE_FILENAME_RE = re.compile(r'[<>:"/\\|?*]')
+
+def print_debug_json(title: str, data: Any) -> None:
+    """Pretty-print a payload when DEBUG is enabled; no serialization otherwise."""
+    if not DEBUG:
+        return
+    print(f"{title}:")
+    print(dump_debug_json(data))
+
+def raise_for_payment_history(history: Dict) -> None:
+    """Refuse a payment the history check doesn't clear
+    
+    Args:
+        history (dict): check_history result
+        
+    Raises:
+        HTTPException: 409 if the invoice was already paid, 503 if the
+            history could not be read
+    """
+    if history["status"] == "error":
+        raise HTTPException(status_code=503, detail="Payment history unavailable")
+    if history["status"] == "processed":
+        raise HTTPException(status_code=409, detail="Invoice already processed")
+
 class ScanInboxRequest(BaseModel):
     """Request model for scanning inbox."""
-    query: Optional[str] = "subject:invoice has:attachment newer_than:7d"
+    query: Optional[str] = "subject:invoice has:attachment filename:pdf newer_than:7d"
     max_results: Optional[int] = 10
 
 class PayInvoiceRequest(BaseModel):
     """Request model for invoice payment."""
     invoice_id: str
 
-def serialize_firebase_data(data: Any) -> Any:
-    """Serialize Firebase data types to JSON-compatible format."""
-    if isinstance(data, dict):
-        return {k: serialize_firebase_data(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [serialize_firebase_data(item) for item in data]
-    elif str(type(data)) == "<class 'google.api_core.datetime_helpers.DatetimeWithNanoseconds'>":
-        return data.isoformat()
-    elif hasattr(data, '_seconds'):  # Firebase Timestamp
-        return datetime.fromtimestamp(data._seconds).isoformat()
-    elif str(type(data)) == "<class 'google.cloud.firestore_v1.transforms.Sentinel'>":
-        return datetime.now().isoformat()
-    elif isinstance(data, datetime):
-        return data.isoformat()
-    return data
-
 async def get_customer_invoices(customer_id: str) -> List[Dict]:
     """Get all invoices for a customer from Firebase."""
     invoices = []
@@ -134,12 +159,13 @@ Please make payment by the due date.
 Thank you for your business!
 """)
     
+    now = datetime.now()
     return [
         {
             "invoice_number": "INV-2024-003",
             "amount": 3500.00,
             "currency": "USD",
-            "due_date": (datetime.now() + timedelta(days=30)).isoformat(),
+            "due_date": (now + timedelta(days=30)).isoformat(),
             "recipient": "New Tech Corp",
             "description": "Cloud Services - February 2024",
             "file_url": str(test_file.absolute()),
@@ -152,7 +178,7 @@ Thank you for your business!
                 "account_type": "checking"
             },
             "metadata": {
-                "invoice_date": datetime.now().isoformat(),
+                "invoice_date": now.isoformat(),
                 "payment_terms": "Net 30",
                 "po_number": "PO-2024-003",
                 "tax_amount": 350.00,
@@ -214,7 +240,7 @@ async def pay_invoice(
         print("\n2️⃣ Verifying invoice ownership...")
         invoice_data = invoice_doc.to_dict()
         invoice_data["id"] = invoice_doc.id
-        print(f"Invoice Data: {json.dumps(serialize_firebase_data(invoice_data), indent=2)}")
+        print_debug_json("Invoice Data", invoice_data)
         
         if invoice_data.get("customer_id") != customer_id:
             print(f"❌ Access denied - Invoice belongs to {invoice_data.get('customer_id')}, not {customer_id}")
@@ -231,14 +257,13 @@ async def pay_invoice(
         
         # Setup file download
         print("\n4️⃣ Setting up file download...")
-        downloads_dir = Path("downloads")
-        downloads_dir.mkdir(exist_ok=True)
+        downloads_dir = ensure_directory("downloads")
         
         file_name = os.path.basename(file_path)
         if not file_name:
             file_name = f"invoice_{request.invoice_id}.pdf"
         else:
-            file_name = re.sub(r'[<>:"/\\|?*]', '_', file_name)
+            file_name = UNSAFE_FILENAME_RE.sub('_', file_name)
             
         local_path = downloads_dir / file_name
         print(f"Download path: {local_path}")
@@ -249,10 +274,13 @@ async def pay_invoice(
             blob = bucket.blob(file_path)
             blob.download_to_filename(str(local_path))
             
-            if not os.path.exists(local_path):
+            # One stat both confirms the download and reports its size
+            try:
+                file_size = os.stat(local_path).st_size
+            except FileNotFoundError:
                 print("❌ File download failed - File not found at local path")
                 raise HTTPException(status_code=500, detail="Failed to download invoice file")
-            print(f"✅ File downloaded successfully ({os.path.getsize(local_path)} bytes)")
+            print(f"✅ File downloaded successfully ({file_size} bytes)")
             
         except Exception as e:
             print(f"❌ File download error: {str(e)}")
@@ -270,15 +298,14 @@ async def pay_invoice(
         try:
             # Extract payment details
             print("\n7️⃣ Extracting payment details from PDF...")
-            payment_details = extract_text(str(local_path), extract_metadata=True)
+            payment_details = extract_text(str(local_path))
             
             if not payment_details or "error" in payment_details:
                 error_msg = payment_details.get("error", "Failed to extract payment details from PDF")
                 print(f"❌ Extraction failed: {error_msg}")
                 raise ValueError(error_msg)
             
-            print("Extracted Payment Details:")
-            print(json.dumps(payment_details, indent=2))
+            print_debug_json("Extracted Payment Details", payment_details)
             
             # Save extracted details regardless of payment outcome
             metadata_update = {
@@ -314,37 +341,51 @@ async def pay_invoice(
             print("\n[PAYMAN] Payment Flow:")
             print("-" * 50)
             
-            # 1. Check balance first
-            print("\n[PAYMAN] 1. Checking balance...")
-            balance_tool = BalanceTool()
-            balance_result = balance_tool.run("")
-            print(f"Balance check result: {balance_result}")
+            # Refuse to pay an invoice the history already records as paid,
+            # and refuse when the history can't be read
+            print("\n[PAYMAN] Checking payment history...")
+            email_data = {
+                "message_id": invoice_data.get("message_id"),
+                "thread_id": invoice_data.get("thread_id"),
+                "attachment_id": invoice_data.get("attachment_id"),
+                "sender": invoice_data.get("sender"),
+                "subject": invoice_data.get("subject")
+            }
+            history = await acheck_history(payment_details, email_data)
+            print(f"History check result: {history['status']}")
+            raise_for_payment_history(history)
+            
+            # 1-2. prepare_payment checks the balance and searches for the
+            # payee concurrently, off the event loop
+            print("\n[PAYMAN] 1. Checking balance and searching for payee...")
+            prepare_tool = TOOLS_BY_NAME["prepare_payment"]
+            search_params = {
+                "name": payment_details.get("recipient"),
+                "type": "US_ACH"
+            }
+            prepared = await asyncio.to_thread(prepare_tool.run_dict, search_params)
+            available_balance = prepared["balance"]
+            payees = prepared["payees"]
+            print(f"Balance check result: {format_currency(available_balance)}")
             
             # Save balance check result
+            required_amount = extract_payment_amount(payment_details)
             invoice_ref.update({
                 "payment_processing": {
                     "balance_check": {
                         "timestamp": firestore.SERVER_TIMESTAMP,
-                        "available_balance": float(balance_result.split("$")[1].replace(",", "").split()[0]),
+                        "available_balance": available_balance,
                         "required_amount": payment_details.get("paid_amount"),
-                        "status": "insufficient" if "insufficient" in balance_result.lower() else "sufficient"
+                        "status": "insufficient" if required_amount and available_balance < required_amount else "sufficient"
                     }
                 }
             })
             
-            # 2. Search for existing payee
-            print("\n[PAYMAN] 2. Searching for payee...")
-            search_tool = SearchPayeesTool()
-            search_params = {
-                "name": payment_details.get("recipient"),
-                "type": "US_ACH"
-            }
-            search_result = search_tool.run(json.dumps(search_params))
-            print(f"Search result: {search_result}")
+            print(f"Search result: {payees}")
             
             # Save payee search result
-            if isinstance(search_result, list) and search_result:
-                payee_data = search_result[0]
+            if payees:
+                payee_data = payees[0]
                 invoice_ref.update({
                     "payment_processing.payee_details": {
                         "timestamp": firestore.SERVER_TIMESTAMP,
@@ -370,8 +411,7 @@ async def pay_invoice(
                 "payee_details": payment_details.get("payee_details", {}),
                 "customer_details": payment_details.get("customer", {})
             }
-            print("\n[PAYMAN] 3. Payment Request Data:")
-            print(json.dumps(payment_data, indent=2))
+            print_debug_json("\n[PAYMAN] 3. Payment Request Data", payment_data)
             
             # Save payment request data
             invoice_ref.update({
@@ -383,7 +423,8 @@ async def pay_invoice(
             
             # 4. Process payment
             print("\n[PAYMAN] 4. Processing payment...")
-            payment_result = await process_payment(payment_data)
+            payment_result = await process_payment(payment_data, prepared=prepared)
+            await asyncio.to_thread(save_payment_history, email_data, payment_details, payment_result)
             
             if not payment_result.get("success"):
                 error_msg = payment_result.get("error", "Payment processing failed")
@@ -412,18 +453,18 @@ async def pay_invoice(
             print(f"• Invoice Number: {payment_result.get('invoice_number')}")
             print("-" * 50)
             
-            print("\nPayment Result:")
-            print(json.dumps(payment_result, indent=2))
+            print_debug_json("\nPayment Result", payment_result)
             
             # Save successful payment details
+            processed_at = datetime.now().isoformat()
             payment_update = {
                 "status": "paid",
-                "paid_at": datetime.now().isoformat(),
+                "paid_at": processed_at,
                 "payment_processing": {
                     "status": "completed",
-                    "completed_at": datetime.now().isoformat(),
+                    "completed_at": processed_at,
                     "payment_details": {
-                        "processed_at": datetime.now().isoformat(),
+                        "processed_at": processed_at,
                         "status": "success",
                         "amount": payment_details.get("paid_amount"),
                         "recipient": payment_details.get("recipient"),
@@ -438,8 +479,7 @@ async def pay_invoice(
                     "file_path": str(local_path)
                 }
             }
-            print("Final Update Data:")
-            print(json.dumps(payment_update, indent=2))
+            print_debug_json("Final Update Data", payment_update)
             
             # Convert timestamps before updating Firebase
             firebase_payment_update = payment_update.copy()
@@ -449,16 +489,19 @@ async def pay_invoice(
             invoice_ref.update(firebase_payment_update)
             print("✅ Payment finalized")
         
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"\n❌ Payment processing error: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Payment processing failed: {str(e)}")
         finally:
             # Clean up downloaded file
-            if 'local_path' in locals() and os.path.exists(local_path):
+            if 'local_path' in locals():
                 try:
-                    print("\n🧹 Cleaning up downloaded file...")
                     os.remove(local_path)
-                    print("✅ File cleanup successful")
+                    print("\n🧹 Cleaned up downloaded file")
+                except FileNotFoundError:
+                    pass
                 except Exception as e:
                     print(f"⚠️ File cleanup failed: {str(e)}")
 
@@ -477,7 +520,7 @@ async def pay_invoice(
                 "recipient": payment_details.get("recipient"),
                 "payment_method": payment_result.get("payment_method"),
                 "external_reference": payment_result.get("external_reference"),
-                "processed_at": datetime.now().isoformat(),
+                "processed_at": processed_at,
                 "description": payment_details.get("description"),
                 "invoice_number": payment_details.get("invoice_number"),
                 "transaction_details": payment_result
@@ -493,6 +536,8 @@ async def pay_invoice(
         print("="*50)
         return response
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"\n❌ Unexpected Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
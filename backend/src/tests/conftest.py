@@ -0,0 +1,27 @@
+"""Shared fixtures for the backend tests."""
+
+import os
+import sys
+
+import pytest
+
+# Import modules the same way the entry points do, from backend/src
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The agent modules read these at import; tests never reach the real services
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
+os.environ.setdefault("COMPOSIO_API_KEY", "test-composio-key")
+os.environ.setdefault("PAYMAN_API_SECRET", "test-payman-secret")
+os.environ.setdefault("JWT_SECRET", "test-jwt-secret")
+
+@pytest.fixture
+def history_db(tmp_path, monkeypatch):
+    """Point the payment history at an empty database for one test"""
+    from agents import payment_agent
+    
+    monkeypatch.setattr(payment_agent, "PAYMENT_HISTORY_DB", tmp_path / "payment_history.db")
+    monkeypatch.setattr(payment_agent, "PAYMENT_HISTORY_FILE", tmp_path / "payment_history.json")
+    monkeypatch.setattr(payment_agent, "_history_db", None)
+    yield payment_agent
+    if payment_agent._history_db is not None:
+        payment_agent._history_db.close()
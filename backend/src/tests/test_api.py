@@ -0,0 +1,30 @@
+"""Tests for the API's handling of payment history results."""
+
+import importlib
+import sys
+
+import firebase_admin
+import pytest
+from fastapi import HTTPException
+from firebase_admin import credentials, firestore, storage
+
+@pytest.fixture
+def api(monkeypatch):
+    """Import the API module without connecting to Firebase"""
+    monkeypatch.setattr(credentials, "Certificate", lambda *args, **kwargs: None)
+    monkeypatch.setattr(firebase_admin, "initialize_app", lambda *args, **kwargs: None)
+    monkeypatch.setattr(firestore, "client", lambda *args, **kwargs: None)
+    monkeypatch.setattr(storage, "bucket", lambda *args, **kwargs: None)
+    monkeypatch.delitem(sys.modules, "api", raising=False)
+    return importlib.import_module("api")
+
+@pytest.mark.parametrize("status, status_code", [("processed", 409), ("error", 503)])
+def test_refused_history_results(api, status, status_code):
+    with pytest.raises(HTTPException) as excinfo:
+        api.raise_for_payment_history({"status": status, "record": None})
+    assert excinfo.value.status_code == status_code
+
+@pytest.mark.parametrize("status", ["none", "duplicate"])
+def test_payable_history_results(api, status):
+    # A failed earlier attempt may be retried
+    api.raise_for_payment_history({"status": status, "record": None})
@@ -0,0 +1,72 @@
+"""Tests for the SQLite payment history."""
+
+INVOICE = {
+    "invoice_number": "INV-2024-001",
+    "recipient": "Slingshot AI",
+    "date": "2024-01-17",
+    "paid_amount": 2500.00
+}
+
+# Same invoice as extracted from a PDF without a date
+UNDATED_INVOICE = {key: value for key, value in INVOICE.items() if key != "date"}
+
+def test_saved_row_is_found_without_optional_fields(history_db):
+    # No date and no email identifiers: stored as NULL and matched as NULL
+    history_db.save_payment_history({}, UNDATED_INVOICE, {"success": False, "error": "Declined"})
+    
+    db = history_db.get_history_db()
+    exact, similar = history_db._find_history_records(db, UNDATED_INVOICE, {})
+    assert exact is None
+    assert similar["invoice_number"] == "INV-2024-001"
+    assert similar["date"] is None
+    assert similar["message_id"] is None
+
+def test_empty_strings_are_stored_and_matched_as_missing(history_db):
+    history_db.save_payment_history({"message_id": ""}, dict(INVOICE, date=""), {"success": False})
+    
+    db = history_db.get_history_db()
+    _, similar = history_db._find_history_records(db, UNDATED_INVOICE, {})
+    assert similar is not None
+
+def test_repeated_failures_are_recorded_once(history_db):
+    for _ in range(3):
+        history_db.save_payment_history({}, UNDATED_INVOICE, {"success": False, "error": "Declined"})
+    
+    db = history_db.get_history_db()
+    assert db.execute("SELECT COUNT(*) FROM payments").fetchone()[0] == 1
+
+def test_check_history_new_invoice(history_db):
+    assert history_db.check_history(INVOICE, {}) == {"status": "none", "record": None}
+
+def test_check_history_failed_attempt_is_duplicate(history_db):
+    history_db.save_payment_history({}, UNDATED_INVOICE, {"success": False, "error": "Declined"})
+    
+    history = history_db.check_history(UNDATED_INVOICE, {})
+    assert history["status"] == "duplicate"
+    assert history["record"]["result"]["error"] == "Declined"
+
+def test_check_history_paid_invoice_is_processed(history_db):
+    history_db.save_payment_history({}, INVOICE, {"success": False, "error": "Declined"})
+    history_db.save_payment_history({}, INVOICE, {"success": True, "payment_id": "pay-1"})
+    
+    history = history_db.check_history(INVOICE, {})
+    assert history["status"] == "processed"
+    assert history["record"]["result"]["payment_id"] == "pay-1"
+
+def test_check_history_matches_paid_email_attachment(history_db):
+    email_data = {"message_id": "msg-1", "attachment_id": "att-1"}
+    history_db.save_payment_history(email_data, INVOICE, {"success": True})
+    
+    # The same attachment re-extracted with different details is still paid
+    other_invoice = {"invoice_number": "INV-2024-999", "recipient": "Other"}
+    assert history_db.check_history(other_invoice, email_data)["status"] == "processed"
+    assert history_db.check_history(other_invoice, {})["status"] == "none"
+
+def test_check_history_fails_closed(history_db, monkeypatch):
+    def unavailable():
+        raise OSError("disk I/O error")
+    monkeypatch.setattr(history_db, "get_history_db", unavailable)
+    
+    history = history_db.check_history(INVOICE, {})
+    assert history["status"] == "error"
+    assert history["error"] == "disk I/O error"
@@ -0,0 +1,66 @@
+"""Tests for batch payments against the payment history."""
+
+import asyncio
+
+class FakeTool:
+    """Stand-in for a Payman tool, recording each call"""
+    
+    def __init__(self, handler):
+        self.handler = handler
+        self.calls = []
+    
+    def run_dict(self, params):
+        self.calls.append(params)
+        return self.handler(params)
+
+def invoice(number, amount=100.0):
+    return {
+        "invoice_number": number,
+        "recipient": "Slingshot AI",
+        "date": "2024-01-17",
+        "paid_amount": amount,
+        "amount": amount
+    }
+
+def test_bulk_skips_paid_and_repeated_invoices(history_db, monkeypatch):
+    sender = FakeTool(lambda params: {"success": True, "payment_id": f"pay-{len(sender.calls)}"})
+    monkeypatch.setattr(history_db, "send_payment_tool", sender)
+    monkeypatch.setattr(history_db, "search_payees_tool", FakeTool(lambda params: [{"id": "payee-1"}]))
+    monkeypatch.setattr(history_db, "get_spendable_balance", lambda: 1000.0)
+    history_db.save_payment_history({}, invoice("INV-1"), {"success": True, "payment_id": "pay-0"})
+    
+    results = asyncio.run(history_db.process_payments_bulk(
+        [invoice("INV-1"), invoice("INV-2"), invoice("INV-2")]
+    ))
+    
+    assert results[0]["error_type"] == "AlreadyProcessed"
+    assert results[1]["success"] is True
+    # Caught in the batch, or by the history once the first copy was recorded
+    assert results[2]["error_type"] in ("DuplicateInBatch", "AlreadyProcessed")
+    assert len(sender.calls) == 1
+    # The new payment is recorded, so the next batch skips it too
+    assert history_db.check_history(invoice("INV-2"), {})["status"] == "processed"
+
+def test_bulk_records_failed_payments(history_db, monkeypatch):
+    sender = FakeTool(lambda params: {"success": False, "error": "Declined"})
+    monkeypatch.setattr(history_db, "send_payment_tool", sender)
+    monkeypatch.setattr(history_db, "search_payees_tool", FakeTool(lambda params: [{"id": "payee-1"}]))
+    monkeypatch.setattr(history_db, "get_spendable_balance", lambda: 1000.0)
+    
+    results = asyncio.run(history_db.process_payments_bulk([invoice("INV-3")]))
+    
+    assert results[0]["success"] is False
+    # A failed attempt may be retried
+    assert history_db.check_history(invoice("INV-3"), {})["status"] == "duplicate"
+
+def test_bulk_fails_closed_without_history(history_db, monkeypatch):
+    sender = FakeTool(lambda params: {"success": True})
+    monkeypatch.setattr(history_db, "send_payment_tool", sender)
+    monkeypatch.setattr(history_db, "search_payees_tool", FakeTool(lambda params: [{"id": "payee-1"}]))
+    monkeypatch.setattr(history_db, "get_spendable_balance", lambda: 1000.0)
+    monkeypatch.setattr(history_db, "check_history", lambda *args: {"status": "error", "record": None, "error": "locked"})
+    
+    results = asyncio.run(history_db.process_payments_bulk([invoice("INV-4")]))
+    
+    assert results[0]["error_type"] == "HistoryUnavailable"
+    assert sender.calls == []
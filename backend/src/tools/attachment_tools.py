@@ -2,7 +2,9 @@
 
 from typing import Dict, List, Optional
 import os
-import shutil
+import threading
+import hashlib
+from concurrent.futures import as_completed
 from pathlib import Path
 import json
 from datetime import datetime
@@ -10,10 +12,24 @@ from datetime import datetime
 from tools.shared_tools import (
     debug_print,
     get_composio_tool,
+    prefetch_composio_tools,
+    configure_composio_http_pool,
+    get_io_pool,
     get_safe_filename,
+    link_or_copy,
+    write_base64_file,
     ensure_directory
 )
 
+# Discover the attachment tool in the background so the first agent doesn't wait
+prefetch_composio_tools(['GMAIL_GET_ATTACHMENT'])
+
+# Maximum number of concurrent Gmail attachment downloads
+MAX_DOWNLOAD_WORKERS = 5
+
+# Subdirectory of the download directory that records completed downloads
+DOWNLOAD_CACHE_DIR = ".cache"
+
 class AttachmentAgent:
     def __init__(self, download_dir: str = "downloads", debug: bool = False):
         """Initialize the attachment agent
@@ -31,6 +47,12 @@ class AttachmentAgent:
         if not self.attachment_tool:
             raise ValueError("Failed to initialize Gmail attachment tool")
         
+        # Keep one pooled connection per concurrent download alive
+        configure_composio_http_pool(MAX_DOWNLOAD_WORKERS, debug=debug)
+        
+        # Records of completed downloads keyed by message and attachment ID
+        self._cache_dir = ensure_directory(self.download_dir / DOWNLOAD_CACHE_DIR)
+        
         if self.debug:
             debug_print("Attachment Agent Initialized", {
                 "download_dir": str(self.download_dir),
@@ -56,6 +78,12 @@ class AttachmentAgent:
                     "filename": filename
                 })
             
+            cached = self._load_cached_download(message_id, attachment_id)
+            if cached:
+                if self.debug:
+                    debug_print("Cached Download", cached)
+                return cached
+            
             print(f"\n📥 Downloading: {filename}")
             
             # Prepare API request
@@ -75,24 +103,19 @@ class AttachmentAgent:
             if self.debug:
                 debug_print("API Response", result)
             
-            if result.get('successfull') and result.get('data', {}).get('file'):
-                file_path = result['data']['file']
-                
-                if self.debug:
-                    debug_print("File Path from API", file_path)
-                
-                # Create a unique filename to avoid overwrites
-                target_path = get_safe_filename(self.download_dir, filename)
-                
+            data = result.get('data', {}) if result.get('successfull') else {}
+            
+            if data.get('file') or data.get('data'):
                 try:
-                    # Copy file to download directory
-                    shutil.copy2(file_path, target_path)
-                    result = {
-                        'success': True,
-                        'file_path': str(target_path),
-                        'original_name': filename,
-                        'size': os.path.getsize(target_path)
-                    }
+                    if data.get('file'):
+                        if self.debug:
+                            debug_print("File Path from API", data['file'])
+                        result = self._save_from_file_path(data['file'], filename)
+                    else:
+                        # Older responses inline the base64url content
+                        result = self._save_from_base64(data['data'], filename)
+                    
+                    self._store_cached_download(message_id, attachment_id, result)
                     
                     if self.debug:
                         debug_print("Download Success", result)
@@ -144,15 +167,23 @@ class AttachmentAgent:
             if self.debug:
                 debug_print("Multiple Download Request", attachments)
             
-            results = []
+            results = [None] * len(attachments)
             print("\n📥 Processing attachments...")
-            for attachment in attachments:
-                result = self.download_attachment(
+            
+            # Downloads are independent I/O-bound calls, so run them concurrently
+            # and store each result at its original index
+            executor = get_io_pool()
+            futures = {
+                executor.submit(
+                    self.download_attachment,
                     message_id=attachment['message_id'],
                     attachment_id=attachment['attachment_id'],
                     filename=attachment['filename']
-                )
-                results.append(result)
+                ): index
+                for index, attachment in enumerate(attachments)
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
             
             if self.debug:
                 debug_print("Multiple Download Results", results)
@@ -172,6 +203,95 @@ class AttachmentAgent:
                 'filename': att.get('filename', 'Unknown')
             } for att in attachments]
 
+    def _cache_path(self, message_id: str, attachment_id: str) -> Path:
+        """Get the cache record path for an attachment"""
+        key = hashlib.sha1(f"{message_id}:{attachment_id}".encode()).hexdigest()
+        return self._cache_dir / f"{key}.json"
+    
+    def _load_cached_download(self, message_id: str, attachment_id: str) -> Optional[Dict]:
+        """Return the result of an earlier download if its file is still intact
+        
+        Args:
+            message_id (str): Gmail message ID
+            attachment_id (str): Attachment ID
+            
+        Returns:
+            dict: Cached download result, or None if it must be downloaded
+        """
+        try:
+            with open(self._cache_path(message_id, attachment_id), "r") as f:
+                cached = json.load(f)
+            if os.path.getsize(cached['file_path']) != cached['size']:
+                return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        
+        cached['cached'] = True
+        return cached
+    
+    def _store_cached_download(self, message_id: str, attachment_id: str, result: Dict) -> None:
+        """Record a successful download so later runs can skip it
+        
+        Args:
+            message_id (str): Gmail message ID
+            attachment_id (str): Attachment ID
+            result (dict): Download result to record
+        """
+        cache_path = self._cache_path(message_id, attachment_id)
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(result, f)
+            # Atomic so concurrent readers never see a partial record
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            if self.debug:
+                debug_print("Download Cache Error", str(e))
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+    
+    def _save_from_file_path(self, file_path: str, filename: str) -> Dict:
+        """Copy a file produced by the attachment tool into the download directory
+        
+        Args:
+            file_path (str): Path of the file written by the tool
+            filename (str): Original filename
+            
+        Returns:
+            dict: Download result with success status and file details
+        """
+        target_path = get_safe_filename(self.download_dir, filename)
+        link_or_copy(file_path, target_path)
+        
+        return {
+            'success': True,
+            'file_path': str(target_path),
+            'original_name': filename,
+            'size': os.path.getsize(target_path)
+        }
+    
+    def _save_from_base64(self, data: str, filename: str) -> Dict:
+        """Decode base64url attachment data and save it to the download directory
+        
+        Args:
+            data (str): Base64url-encoded attachment content
+            filename (str): Original filename
+            
+        Returns:
+            dict: Download result with success status and file details
+        """
+        target_path = get_safe_filename(self.download_dir, filename)
+        size = write_base64_file(data, target_path)
+        
+        return {
+            'success': True,
+            'file_path': str(target_path),
+            'original_name': filename,
+            'size': size
+        }
+    
 def main():
     # Example usage
     try:
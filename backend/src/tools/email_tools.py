@@ -1,27 +1,24 @@
 """Tools for handling email operations."""
 
-from langchain.agents import create_openai_functions_agent, AgentExecutor
-from langchain import hub
-from composio_langchain import ComposioToolSet
 from pathlib import Path
-import os
 from typing import Dict, List, Optional
-import json
 from datetime import datetime
 
-from tools.shared_tools import get_composio_tool, debug_print
+from tools.shared_tools import (
+    get_composio_tool,
+    debug_print,
+    summarize_debug_data,
+    dump_debug_json
+)
 from tools.attachment_tools import AttachmentAgent
 
-# Initialize Composio toolset with API key
-COMPOSIO_API_KEY = os.getenv("COMPOSIO_API_KEY")
-composio_tools = ComposioToolSet(api_key=COMPOSIO_API_KEY)
-
 def debug_print(title: str, data: any, indent: int = 2):
     """Print debug information with consistent formatting"""
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"\n[{timestamp}] [EMAIL] {title}:")
+    data = summarize_debug_data(data)
     if isinstance(data, (dict, list)):
-        print(json.dumps(data, indent=indent, default=str))
+        print(dump_debug_json(data))
     else:
         print(data)
     print("-" * 50)
@@ -31,7 +28,7 @@ class GmailAgent:
     
     def __init__(self, debug: bool = False):
         self.debug = debug
-        self.gmail_tool = composio_tools.get_tool("GMAIL_REPLY_TO_THREAD")
+        self.gmail_tool = get_composio_tool("GMAIL_REPLY_TO_THREAD", debug=debug)
         if not self.gmail_tool:
             raise ValueError("Failed to initialize Gmail reply tool")
         
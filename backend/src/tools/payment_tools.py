@@ -1,25 +1,50 @@
 """Payment tools module for handling payment operations using LangChain tools."""
 
-from typing import List, Dict, Any, Optional, Union, TypeVar, Callable
+from typing import List, Dict, Any, Optional, Tuple, Union, TypeVar, Callable
 from langchain_core.tools import BaseTool
 from pydantic import BaseModel, Field
 import os
-import json
+import asyncio
+import orjson
+import logging
+import threading
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
 from paymanai import Paymanai
 from functools import wraps
 import traceback
 import requests
 
+from tools.shared_tools import DEBUG, dump_debug_json, get_io_pool
+
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Initialize Payman client
 client = Paymanai(
     x_payman_api_secret=os.getenv("PAYMAN_API_SECRET"),
     environment="sandbox"
 )
 
+# Payee search results are reused for this many seconds, keeping at most
+# PAYEE_CACHE_SIZE searches; recurring vendors skip the Payman round-trip
+PAYEE_CACHE_TTL = 300
+PAYEE_CACHE_SIZE = 1024
+_payee_cache: OrderedDict = OrderedDict()
+_payee_cache_lock = threading.Lock()
+
+# Spendable balance is reused for this many seconds; successful sends deduct
+# from the cached reading instead of forcing a new request
+BALANCE_CACHE_TTL = 5
+_balance_cache: Optional[Tuple[float, float]] = None
+_balance_cache_lock = threading.Lock()
+# Number of sends deducted so far; a reading fetched while one completed may
+# predate it, so it is returned but not cached
+_balance_sends = 0
+
 # Type definitions
 T = TypeVar('T')
 PaymanResponse = Union[Dict[str, Any], Any]
@@ -28,8 +53,8 @@ def handle_api_response(response: PaymanResponse, key: str = None) -> Any:
     """Handle Payman API response consistently."""
     if isinstance(response, str):
         try:
-            response = json.loads(response)
-        except json.JSONDecodeError:
+            response = orjson.loads(response)
+        except orjson.JSONDecodeError:
             return None
     
     if isinstance(response, dict):
@@ -46,6 +71,90 @@ def safe_api_call(func: Callable[..., T]) -> Callable[..., T]:
             return f"❌ Error: {str(e)}"
     return wrapper
 
+def _payee_cache_key(params: Dict) -> tuple:
+    """Normalize search parameters so equivalent searches share an entry"""
+    name = params.get("name")
+    email = params.get("contact_email")
+    return (
+        name.strip().lower() if name else None,
+        email.strip().lower() if email else None,
+        params.get("type", "US_ACH")
+    )
+
+def get_cached_payees(params: Dict) -> Optional[List[Dict]]:
+    """Get a fresh cached payee search result
+    
+    Args:
+        params (dict): Search parameters (name, contact_email, type)
+        
+    Returns:
+        list: Cached payees, or None if not cached or expired
+    """
+    key = _payee_cache_key(params)
+    with _payee_cache_lock:
+        entry = _payee_cache.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= PAYEE_CACHE_TTL:
+            del _payee_cache[key]
+            return None
+        _payee_cache.move_to_end(key)
+        return entry[1]
+
+def cache_payees(params: Dict, payees: Optional[List[Dict]]) -> None:
+    """Store a payee search result, or drop the entry if nothing was found
+    
+    Args:
+        params (dict): Search parameters (name, contact_email, type)
+        payees (list, optional): Payees found; empty or None invalidates
+    """
+    key = _payee_cache_key(params)
+    with _payee_cache_lock:
+        # Misses aren't cached, so newly created payees are found right away
+        if not payees:
+            _payee_cache.pop(key, None)
+            return
+        _payee_cache[key] = (time.monotonic(), payees)
+        _payee_cache.move_to_end(key)
+        while len(_payee_cache) > PAYEE_CACHE_SIZE:
+            _payee_cache.popitem(last=False)
+
+def get_spendable_balance() -> float:
+    """Get the spendable USD balance, reusing a reading up to BALANCE_CACHE_TTL old
+    
+    Returns:
+        float: Spendable balance
+    """
+    global _balance_cache
+    
+    cached = _balance_cache
+    if cached is not None and time.monotonic() - cached[0] < BALANCE_CACHE_TTL:
+        return cached[1]
+    
+    with _balance_cache_lock:
+        sends = _balance_sends
+    fetched_at = time.monotonic()
+    balance = float(client.balances.get_spendable_balance("USD"))
+    with _balance_cache_lock:
+        # Never replace a newer reading or drop a deduction made meanwhile
+        newer_cached = _balance_cache is not None and _balance_cache[0] >= fetched_at
+        if sends == _balance_sends and not newer_cached:
+            _balance_cache = (fetched_at, balance)
+    return balance
+
+def deduct_cached_balance(amount: float) -> None:
+    """Account for a successful payment in the cached balance
+    
+    Args:
+        amount (float): Amount sent
+    """
+    global _balance_cache, _balance_sends
+    
+    with _balance_cache_lock:
+        _balance_sends += 1
+        if _balance_cache is not None:
+            _balance_cache = (_balance_cache[0], _balance_cache[1] - amount)
+
 # Define input schemas
 class PaymentItem(BaseModel):
     """Schema for a single payment item."""
@@ -84,8 +193,16 @@ class PaymentResult(BaseModel):
 
 def format_payment_summary(results: List[PaymentResult], total_amount: float, final_balance: Optional[float] = None) -> str:
     """Format payment results into a readable summary."""
-    successful = [r for r in results if r.status == 'success']
-    failed = [r for r in results if r.status == 'failed']
+    # Partition the results and total the successful amounts in one pass
+    successful = []
+    failed = []
+    processed_amount = 0.0
+    for r in results:
+        if r.status == 'success':
+            successful.append(r)
+            processed_amount += r.amount
+        elif r.status == 'failed':
+            failed.append(r)
     
     summary = []
     
@@ -106,7 +223,7 @@ def format_payment_summary(results: List[PaymentResult], total_amount: float, fi
     summary.append(f"- Total payments: {len(results)}")
     summary.append(f"- Successful: {len(successful)}")
     summary.append(f"- Failed: {len(failed)}")
-    summary.append(f"- Total amount processed: ${sum(r.amount for r in successful):.2f}")
+    summary.append(f"- Total amount processed: ${processed_amount:.2f}")
     if final_balance is not None:
         summary.append(f"- Remaining balance: ${final_balance:.2f}")
     
@@ -120,8 +237,8 @@ class BalanceTool(BaseTool):
     @safe_api_call
     def _run(self, *args: Any, **kwargs: Any) -> str:
         """Get the current spendable balance."""
-        balance = client.balances.get_spendable_balance("USD")
-        return f"Current balance: ${float(balance):.2f}"
+        balance = get_spendable_balance()
+        return f"Current balance: ${balance:.2f}"
 
 class SearchPayeesTool(BaseTool):
     """Tool for searching payment destinations."""
@@ -133,12 +250,29 @@ class SearchPayeesTool(BaseTool):
     def _run(self, tool_input: str) -> str:
         """Search for payment destinations."""
         try:
-            # Parse search parameters
-            params = json.loads(tool_input)
+            params = orjson.loads(tool_input)
+        except orjson.JSONDecodeError as e:
+            logger.error("\n[PAYMAN] ❌ Invalid search parameters: %s", e)
+            return orjson.dumps([]).decode()
+        return orjson.dumps(self.run_dict(params)).decode()
+    
+    def run_dict(self, params: Dict) -> List[Dict]:
+        """Search for payment destinations without the JSON string round-trip.
+        
+        Args:
+            params (dict): Search parameters (name, contact_email, type)
+            
+        Returns:
+            list: Matching payees, empty if none were found or the search failed
+        """
+        try:
+            if DEBUG:
+                logger.debug("\n[PAYMAN] 🔍 Search Request:\n%s\n%s", "-" * 40, dump_debug_json(params))
             
-            print("\n[PAYMAN] 🔍 Search Request:")
-            print("-" * 40)
-            print(json.dumps(params, indent=2))
+            payees = get_cached_payees(params)
+            if payees is not None:
+                logger.info("\n[PAYMAN] ✅ Found %d cached payees", len(payees))
+                return payees
             
             # Call Payman API
             response = client.payments.search_payees(
@@ -150,35 +284,69 @@ class SearchPayeesTool(BaseTool):
             # Parse the response if it's a string
             if isinstance(response, str):
                 try:
-                    payees = json.loads(response)
-                except json.JSONDecodeError:
-                    print("\n[PAYMAN] ❌ Failed to parse API response - Invalid JSON")
-                    return json.dumps([])
+                    payees = orjson.loads(response)
+                except orjson.JSONDecodeError:
+                    logger.error("\n[PAYMAN] ❌ Failed to parse API response - Invalid JSON")
+                    return []
             else:
                 payees = response
+            cache_payees(params, payees)
             
             # Log search results
             if payees:
-                print(f"\n[PAYMAN] ✅ Found {len(payees)} payees in Payman")
+                logger.info("\n[PAYMAN] ✅ Found %d payees in Payman", len(payees))
                 for idx, payee in enumerate(payees[:3], 1):  # Show first 3 payees
-                    print(f"\n[PAYMAN] 👤 Payee {idx}:")
-                    print(f"  • Name: {payee.get('name', 'Unknown')}")
-                    print(f"  • ID: {payee.get('id', 'Unknown')}")
+                    logger.info(
+                        "\n[PAYMAN] 👤 Payee %d:\n  • Name: %s\n  • ID: %s",
+                        idx, payee.get('name', 'Unknown'), payee.get('id', 'Unknown')
+                    )
             else:
-                print("\n[PAYMAN] ⚠️ No payees found in Payman")
+                logger.info("\n[PAYMAN] ⚠️ No payees found in Payman")
             
-            return json.dumps(payees)
+            return payees
             
         except Exception as e:
-            print(f"\n[PAYMAN] ❌ API Error:")
-            print(f"  • Type: {type(e).__name__}")
-            print(f"  • Details: {str(e)}")
-            return json.dumps([])
+            logger.error("\n[PAYMAN] ❌ API Error:\n  • Type: %s\n  • Details: %s", type(e).__name__, e)
+            return []
     
     def _arun(self, tool_input: str) -> str:
         """Async version of run."""
         raise NotImplementedError("SearchPayeesTool does not support async")
 
+class PreparePaymentTool(BaseTool):
+    """Tool for fetching the balance and matching payees in one step."""
+    
+    name: str = "prepare_payment"
+    description: str = "Get the current spendable balance in USD and search for payment destinations by name or email in one call"
+    
+    @safe_api_call
+    def _run(self, tool_input: str) -> str:
+        """Fetch the balance while searching for payees."""
+        return orjson.dumps(self.run_dict(orjson.loads(tool_input))).decode()
+    
+    def run_dict(self, params: Dict) -> Dict:
+        """Fetch the balance while searching for payees, without JSON strings.
+        
+        Args:
+            params (dict): Search parameters, as for search_payees
+            
+        Returns:
+            dict: {"balance": float, "payees": list}
+        """
+        # The two Payman calls are independent, so the balance request runs
+        # on the shared I/O pool while the search runs on this thread
+        balance = get_io_pool().submit(get_spendable_balance)
+        payees = TOOLS_BY_NAME["search_payees"].run_dict(params)
+        
+        return {
+            "balance": balance.result(),
+            "payees": payees
+        }
+    
+    async def _arun(self, tool_input: str) -> str:
+        """Async version of run."""
+        return await asyncio.to_thread(self._run, tool_input)
+
 class SendPaymentTool(BaseTool):
     name: str = "send_payment"
     description: str = "Send a payment to a destination. Requires amount (float), destination_id (str), and optional memo (str)."
@@ -187,12 +355,31 @@ class SendPaymentTool(BaseTool):
     def _run(self, tool_input: str) -> str:
         """Send a payment to a destination."""
         try:
-            # Parse payment parameters
-            params = json.loads(tool_input)
+            params = orjson.loads(tool_input)
+        except orjson.JSONDecodeError as e:
+            logger.error("\n[PAYMAN] ❌ Invalid payment parameters: %s", e)
+            return orjson.dumps({
+                "success": False,
+                "error": str(e),
+                "error_type": type(e).__name__
+            }).decode()
+        # Payman response objects may hold values JSON can't encode
+        return orjson.dumps(self.run_dict(params), default=str).decode()
+    
+    def run_dict(self, params: Dict) -> Dict:
+        """Send a payment without the JSON string round-trip.
+        
+        Args:
+            params (dict): amount, destination_id and optional memo
             
-            print(f"\n[PAYMAN] 💸 Processing payment request:")
-            print("-" * 40)
-            print(json.dumps(params, indent=2))
+        Returns:
+            dict: Payment result with 'success' and either payment details or
+                'error' and 'error_type'
+        """
+        try:
+            logger.info("\n[PAYMAN] 💸 Processing payment request:")
+            if DEBUG:
+                logger.debug("%s\n%s", "-" * 40, dump_debug_json(params))
             
             # Send payment using Payman client
             payment = client.payments.send_payment(
@@ -201,52 +388,51 @@ class SendPaymentTool(BaseTool):
                 memo=params.get("memo")
             )
             
-            print(f"\n[PAYMAN] 💸 Raw Payment Response:")
-            print("-" * 40)
-            print(json.dumps(payment, indent=2, default=str))
+            if DEBUG:
+                logger.debug("\n[PAYMAN] 💸 Raw Payment Response:\n%s\n%s", "-" * 40, dump_debug_json(payment))
             
             # Handle response serialization
             if hasattr(payment, '__dict__'):
                 payment_dict = payment.__dict__
             elif isinstance(payment, str):
                 try:
-                    payment_dict = json.loads(payment)
-                except json.JSONDecodeError:
+                    payment_dict = orjson.loads(payment)
+                except orjson.JSONDecodeError:
                     payment_dict = {"error": "Invalid JSON response"}
             elif isinstance(payment, dict):
                 payment_dict = payment
             else:
                 payment_dict = {"error": f"Unexpected response type: {type(payment)}"}
             
-            print(f"\n[PAYMAN] 💸 Parsed Payment Response:")
-            print("-" * 40)
-            print(json.dumps(payment_dict, indent=2))
+            if DEBUG:
+                logger.debug("\n[PAYMAN] 💸 Parsed Payment Response:\n%s\n%s", "-" * 40, dump_debug_json(payment_dict))
             
             # Check for error in response
             if "error" in payment_dict or payment_dict.get("status") == "failed":
                 error_msg = payment_dict.get("error") or "Payment failed"
-                print(f"\n[PAYMAN] ❌ Payment failed: {error_msg}")
-                return json.dumps({
+                logger.error("\n[PAYMAN] ❌ Payment failed: %s", error_msg)
+                return {
                     "success": False,
                     "error": error_msg,
                     "error_type": "PaymentFailed",
                     "details": payment_dict
-                })
+                }
+            
+            deduct_cached_balance(float(params["amount"]))
             
             # Extract important fields
             reference = payment_dict.get('reference') or payment_dict.get('payment_id', 'Unknown')
             status = payment_dict.get('status', 'completed')
             
-            print(f"\n[PAYMAN] ✅ Payment processed successfully")
-            print(f"  • Reference: {reference}")
-            print(f"  • Status: {status}")
-            print(f"  • Amount: ${float(params['amount']):.2f}")
-            print(f"  • Destination ID: {params['destination_id']}")
+            logger.info(
+                "\n[PAYMAN] ✅ Payment processed successfully\n"
+                "  • Reference: %s\n  • Status: %s\n  • Amount: $%.2f\n  • Destination ID: %s",
+                reference, status, float(params['amount']), params['destination_id']
+            )
             if params.get('memo'):
-                print(f"  • Memo: {params['memo']}")
+                logger.info("  • Memo: %s", params['memo'])
             
-            # Return serializable response
-            response = {
+            return {
                 "success": True,
                 "payment_id": reference,
                 "status": status,
@@ -254,18 +440,13 @@ class SendPaymentTool(BaseTool):
                 "details": payment_dict
             }
             
-            return json.dumps(response)
-            
         except Exception as e:
-            print(f"\n[PAYMAN] ❌ Payment Error:")
-            print(f"  • Type: {type(e).__name__}")
-            print(f"  • Details: {str(e)}")
-            error_response = {
+            logger.error("\n[PAYMAN] ❌ Payment Error:\n  • Type: %s\n  • Details: %s", type(e).__name__, e)
+            return {
                 "success": False,
                 "error": str(e),
                 "error_type": type(e).__name__
             }
-            return json.dumps(error_response)
 
 class BatchPaymentsTool(BaseTool):
     name: str = "process_batch_payments"
@@ -275,24 +456,27 @@ class BatchPaymentsTool(BaseTool):
     @safe_api_call
     def _run(self, payments: List[PaymentItem], **kwargs: Any) -> str:
         """Process a batch of payments."""
+        # Payments were validated against args_schema and results are built from
+        # their typed fields, so results skip a second validation pass
         results: List[PaymentResult] = []
         total_amount = sum(p.amount for p in payments)
         
         # Check current balance
-        balance = float(client.balances.get_spendable_balance("USD"))
+        balance = get_spendable_balance()
         if balance < total_amount:
             return f"❌ Error: Insufficient funds. Required: ${total_amount:.2f}, Available: ${balance:.2f}"
         
-        print(f"\n[PAYMAN] 📦 Processing batch payment:")
-        print(f"  • Number of payments: {len(payments)}")
-        print(f"  • Total amount: ${total_amount:.2f}")
+        logger.info(
+            "\n[PAYMAN] 📦 Processing batch payment:\n  • Number of payments: %d\n  • Total amount: $%.2f",
+            len(payments), total_amount
+        )
         
         for payment in payments:
             try:
-                print(f"\n[PAYMAN] 📝 Processing individual payment:")
-                print(f"  • ID: {payment.id}")
-                print(f"  • Recipient: {payment.recipientName}")
-                print(f"  • Amount: ${payment.amount:.2f} {payment.currency}")
+                logger.info(
+                    "\n[PAYMAN] 📝 Processing individual payment:\n  • ID: %s\n  • Recipient: %s\n  • Amount: $%.2f %s",
+                    payment.id, payment.recipientName, payment.amount, payment.currency
+                )
                 
                 # Search for payee
                 response = client.payments.search_payees(
@@ -302,7 +486,7 @@ class BatchPaymentsTool(BaseTool):
                 payees = handle_api_response(response)
                 
                 if not payees:
-                    results.append(PaymentResult(
+                    results.append(PaymentResult.model_construct(
                         payment_id=payment.id,
                         recipient=payment.recipientName,
                         amount=payment.amount,
@@ -314,7 +498,7 @@ class BatchPaymentsTool(BaseTool):
                 # Get the first matching payee
                 payee = handle_api_response(payees[0])
                 if not payee:
-                    results.append(PaymentResult(
+                    results.append(PaymentResult.model_construct(
                         payment_id=payment.id,
                         recipient=payment.recipientName,
                         amount=payment.amount,
@@ -327,7 +511,7 @@ class BatchPaymentsTool(BaseTool):
                 payee_name = handle_api_response(payee, 'name') or payment.recipientName
                 
                 if not payee_id:
-                    results.append(PaymentResult(
+                    results.append(PaymentResult.model_construct(
                         payment_id=payment.id,
                         recipient=payment.recipientName,
                         amount=payment.amount,
@@ -336,7 +520,7 @@ class BatchPaymentsTool(BaseTool):
                     ))
                     continue
                 
-                print(f"[PAYMAN] 🎯 Found payee ID: {payee_id}")
+                logger.info("[PAYMAN] 🎯 Found payee ID: %s", payee_id)
                 
                 # Send payment
                 result = client.payments.send_payment(
@@ -345,18 +529,20 @@ class BatchPaymentsTool(BaseTool):
                     memo=payment.memo or f"Payment {payment.id} to {payee_name}"
                 )
                 
+                deduct_cached_balance(payment.amount)
+                
                 ref = handle_api_response(result, 'reference') or 'Unknown'
-                results.append(PaymentResult(
+                results.append(PaymentResult.model_construct(
                     payment_id=payment.id,
                     recipient=payee_name,
                     amount=payment.amount,
                     status='success',
                     reference=ref
                 ))
-                print("[PAYMAN] ✅ Payment completed successfully")
+                logger.info("[PAYMAN] ✅ Payment completed successfully")
             
             except Exception as e:
-                results.append(PaymentResult(
+                results.append(PaymentResult.model_construct(
                     payment_id=payment.id,
                     recipient=payment.recipientName,
                     amount=payment.amount,
@@ -365,7 +551,7 @@ class BatchPaymentsTool(BaseTool):
                 ))
         
         try:
-            final_balance = float(client.balances.get_spendable_balance("USD"))
+            final_balance = get_spendable_balance()
         except:
             final_balance = None
         
@@ -379,22 +565,42 @@ class CheckoutUrlTool(BaseTool):
     @safe_api_call
     def _run(self, amount: float, currency: str = "USD", memo: Optional[str] = None, customer_name: Optional[str] = None, **kwargs: Any) -> str:
         """Generate a checkout URL for adding funds."""
-        print(f"[PAYMAN] 🔗 Generating checkout URL for ${amount:.2f}")
+        url = self.run_dict({
+            "amount": amount,
+            "currency": currency,
+            "memo": memo,
+            "customer_name": customer_name
+        })["url"]
+        return f"✅ Checkout URL generated: {url}" if url else "❌ Error: Failed to generate checkout URL"
+    
+    def run_dict(self, params: Dict) -> Dict:
+        """Generate a checkout URL without the text result.
+        
+        Args:
+            params (dict): amount and optional memo and customer_name
+            
+        Returns:
+            dict: {"url": checkout URL, or None if Payman returned none}
+        """
+        logger.info("[PAYMAN] 🔗 Generating checkout URL for $%.2f", params["amount"])
         response = client.payments.initiate_customer_deposit(
-            amount_decimal=amount,
+            amount_decimal=params["amount"],
             customer_id="default",
-            customer_name=customer_name,
-            memo=memo,
+            customer_name=params.get("customer_name"),
+            memo=params.get("memo"),
             fee_mode="INCLUDED_IN_AMOUNT"
         )
-        url = handle_api_response(response, 'checkout_url')
-        return f"✅ Checkout URL generated: {url}" if url else "❌ Error: Failed to generate checkout URL"
+        return {"url": handle_api_response(response, 'checkout_url')}
 
 # Create tool instances
 tools = [
     BalanceTool(),
     SearchPayeesTool(),
+    PreparePaymentTool(),
     SendPaymentTool(),
     BatchPaymentsTool(),
     CheckoutUrlTool()
-] 
\ No newline at end of file
+]
+
+# Shared tool instances by name, so callers don't rebuild or scan for them
+TOOLS_BY_NAME = {t.name: t for t in tools}
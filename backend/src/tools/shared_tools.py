@@ -1,11 +1,24 @@
 """Shared utilities and tools for all agents."""
 
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 import json
+import binascii
+import errno
+import functools
+import logging
+import mmap
+import re
+import shutil
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from types import FunctionType
 import os
 from datetime import datetime
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv, find_dotenv
 from langchain_openai import ChatOpenAI
 from composio_langchain import ComposioToolSet
@@ -16,16 +29,130 @@ load_dotenv()
 # Get debug mode from environment
 DEBUG = os.getenv("DEBUG", "FALSE").upper() == "TRUE"
 
+# Buffer size for the userspace file copy fallback (tunable via environment)
+COPY_BUFSIZE = int(os.getenv("COPY_BUFSIZE", 256 * 1024))
+
+# Files larger than this are copied through mmap in the fallback path
+MMAP_COPY_THRESHOLD = 2 * 1024 * 1024
+
 # Global cache for Composio tools
-_tools_cache: Dict[str, List] = {}
+_tool_by_action: Dict[str, Any] = {}
+_prefetch_events: Dict[str, threading.Event] = {}
+_composio_init_lock = threading.Lock()
+
+# Base64 characters decoded per write (a multiple of 4, ~192 KiB of output)
+BASE64_CHUNK_SIZE = 4 * 64 * 1024
+_URLSAFE_TO_STANDARD = bytes.maketrans(b'-_', b'+/')
+
+# Decoded chunks gathered into a single writev call
+WRITEV_BATCH = 8
+
+# Worker threads in the shared pool for blocking download and file I/O
+MAX_IO_WORKERS = int(os.getenv("MAX_IO_WORKERS", 5))
+_io_pool: Optional[ThreadPoolExecutor] = None
+_io_pool_lock = threading.Lock()
+
+# Highest used counter per (stem, suffix), per download directory
+_filename_index: Dict[str, Dict[tuple, int]] = {}
+_filename_index_lock = threading.Lock()
+_COUNTER_SUFFIX_RE = re.compile(r'(.*)_(\d+)')
 _composio_client: Optional[ComposioToolSet] = None
+# Connection pool size mounted on the Composio HTTP session, 0 if untouched
+_composio_pool_size = 0
+
+# Longest string value shown in debug output before truncation
+DEBUG_MAX_STRING_LENGTH = 500
+
+def summarize_debug_data(data: Any) -> Any:
+    """Prepare data for debug output
+    
+    Long strings (such as base64 attachment content) are truncated. Values
+    are never called, so objects inside a payload are printed as they are.
+    
+    Args:
+        data (Any): Value to prepare
+        
+    Returns:
+        Any: Value safe to print
+    """
+    if isinstance(data, dict):
+        return {k: summarize_debug_data(v) for k, v in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [summarize_debug_data(v) for v in data]
+    if isinstance(data, (str, bytes)) and len(data) > DEBUG_MAX_STRING_LENGTH:
+        return f"{data[:DEBUG_MAX_STRING_LENGTH]!s}... ({len(data)} total)"
+    return data
+
+def _format_debug_arg(data: Any) -> Any:
+    """Render dicts and lists as indented JSON; other values print as-is"""
+    # A plain function passed straight to debug_print is a deferred payload,
+    # built only when debug output is produced; nested values are not called
+    if isinstance(data, FunctionType):
+        data = data()
+    data = summarize_debug_data(data)
+    if isinstance(data, (dict, list)):
+        return dump_debug_json(data)
+    return data
+
+def configure_logging() -> None:
+    """Configure logging for an entry point (the API server or a script)
+    
+    Library modules only create loggers; entry points call this once. The
+    root level comes from LOG_LEVEL (default INFO), and DEBUG lowers only the
+    app's own loggers, so third-party libraries don't start logging at DEBUG.
+    """
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(message)s"
+    )
+    if DEBUG:
+        for name in ("agents", "tools", "__main__"):
+            logging.getLogger(name).setLevel(logging.DEBUG)
 
 def debug_print(*args: Any, **kwargs: Any) -> None:
     """Enhanced debug print function with timestamp and formatting"""
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"\n[{timestamp}] 🔍 DEBUG:", *args, **kwargs)
+    print(f"\n[{timestamp}] 🔍 DEBUG:", *(_format_debug_arg(a) for a in args), **kwargs)
     print("-" * 50)
 
+def dump_debug_json(data: Any) -> str:
+    """Pretty-print data as JSON for debug output
+    
+    Args:
+        data (Any): Value to serialize; unsupported types fall back to str
+        
+    Returns:
+        str: JSON text indented by two spaces
+    """
+    # orjson only supports two-space indentation
+    return orjson.dumps(
+        data,
+        default=str,
+        option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+    ).decode()
+
+# Firestore value types, compared by name so firebase_admin stays optional here
+_FIRESTORE_DATETIME_TYPE = "<class 'google.api_core.datetime_helpers.DatetimeWithNanoseconds'>"
+_FIRESTORE_SENTINEL_TYPE = "<class 'google.cloud.firestore_v1.transforms.Sentinel'>"
+
+def serialize_firebase_data(data: Any) -> Any:
+    """Serialize Firebase data types to JSON-compatible format."""
+    if isinstance(data, dict):
+        return {k: serialize_firebase_data(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [serialize_firebase_data(item) for item in data]
+    
+    type_name = str(type(data))
+    if type_name == _FIRESTORE_DATETIME_TYPE:
+        return data.isoformat()
+    elif hasattr(data, '_seconds'):  # Firebase Timestamp
+        return datetime.fromtimestamp(data._seconds).isoformat()
+    elif type_name == _FIRESTORE_SENTINEL_TYPE:
+        return datetime.now().isoformat()
+    elif isinstance(data, datetime):
+        return data.isoformat()
+    return data
+
 def format_error(error: Exception, include_traceback: bool = True) -> Dict:
     """Format error information consistently
     
@@ -46,9 +173,33 @@ def format_error(error: Exception, include_traceback: bool = True) -> Dict:
     
     return error_info
 
+def _scan_filename_index(directory: str) -> Dict[tuple, int]:
+    """Build the (stem, suffix) -> highest counter index for a directory
+    
+    Args:
+        directory (str): Directory to scan
+        
+    Returns:
+        dict: Highest counter in use for each (stem, suffix)
+    """
+    index: Dict[tuple, int] = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            stem, suffix = os.path.splitext(entry.name)
+            index[(stem, suffix)] = max(index.get((stem, suffix), 0), 1)
+            match = _COUNTER_SUFFIX_RE.fullmatch(stem)
+            if match:
+                key = (match.group(1), suffix)
+                index[key] = max(index.get(key, 0), int(match.group(2)))
+    return index
+
 def get_safe_filename(directory: str, filename: str) -> Path:
     """Create a safe filename that doesn't overwrite existing files
     
+    Existing names are scanned once per directory; later calls pick the next
+    counter from an in-memory index. Returned names are reserved, so
+    concurrent callers never receive the same path.
+    
     Args:
         directory (str): Directory to save file in
         filename (str): Original filename
@@ -56,19 +207,230 @@ def get_safe_filename(directory: str, filename: str) -> Path:
     Returns:
         Path: Safe file path
     """
-    name = Path(filename).stem
-    suffix = Path(filename).suffix
-    counter = 1
+    filename = os.path.basename(filename)
+    name, suffix = os.path.splitext(filename)
+    key = (name, suffix)
+    directory_path = Path(directory)
     
-    while True:
-        if counter == 1:
-            new_path = Path(directory) / filename
-        else:
-            new_path = Path(directory) / f"{name}_{counter}{suffix}"
+    with _filename_index_lock:
+        dir_key = os.path.abspath(directory)
+        index = _filename_index.get(dir_key)
+        if index is None:
+            index = _filename_index[dir_key] = _scan_filename_index(directory)
+        
+        counter = index.get(key, 0) + 1
+        while True:
+            if counter == 1:
+                new_path = directory_path / filename
+            else:
+                new_path = directory_path / f"{name}_{counter}{suffix}"
+            
+            # Guards against files created outside this process since the scan
+            if not new_path.exists():
+                index[key] = counter
+                return new_path
+            counter += 1
+
+class _GiveupOnFastCopy(Exception):
+    """Raised when a kernel-side copy is unsupported and a fallback is needed"""
+
+# Errors meaning the kernel copy call is unavailable for this pair of files
+_FAST_COPY_FALLBACK_ERRNOS = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EBADF,
+    errno.ENOTSUP,
+    errno.EOPNOTSUPP,
+}
+
+def _kernel_copy(src_fd: int, dst_fd: int, size: int) -> None:
+    """Copy file contents without leaving kernel space
+    
+    Tries copy_file_range first (enables reflinks / server-side copies) and
+    falls back to sendfile.
+    
+    Args:
+        src_fd (int): Source file descriptor
+        dst_fd (int): Destination file descriptor
+        size (int): Source file size in bytes
+        
+    Raises:
+        _GiveupOnFastCopy: If neither syscall can be used for these files
+    """
+    copy_funcs = []
+    if hasattr(os, 'copy_file_range'):
+        copy_funcs.append(lambda count: os.copy_file_range(src_fd, dst_fd, count))
+    if hasattr(os, 'sendfile'):
+        copy_funcs.append(lambda count: os.sendfile(dst_fd, src_fd, None, count))
+    
+    blocksize = max(size, 2 ** 23)  # at least 8 MiB per call
+    for copy_func in copy_funcs:
+        offset = 0
+        try:
+            while True:
+                sent = copy_func(blocksize)
+                offset += sent
+                if sent == 0 or offset >= size:
+                    return
+        except OSError as e:
+            # Only fall back if nothing has been written yet
+            if offset == 0 and e.errno in _FAST_COPY_FALLBACK_ERRNOS:
+                continue
+            raise
+    
+    raise _GiveupOnFastCopy()
+
+def _copy_fileobj_readinto(fsrc, fdst, length: int) -> None:
+    """Copy between file objects reusing a single preallocated buffer
+    
+    Args:
+        fsrc: Source file object supporting readinto
+        fdst: Destination file object
+        length (int): Buffer size in bytes
+    """
+    with memoryview(bytearray(length)) as buf:
+        while True:
+            n = fsrc.readinto(buf)
+            if not n:
+                break
+            if n < length:
+                with buf[:n] as chunk:
+                    fdst.write(chunk)
+            else:
+                fdst.write(buf)
+
+def fast_copy(src: str, dst: str) -> None:
+    """Copy a file and its metadata, using zero-copy syscalls where available
+    
+    Args:
+        src (str): Source file path
+        dst (str): Destination file path
+    """
+    flags = getattr(os, 'O_BINARY', 0)
+    src_fd = os.open(src, os.O_RDONLY | flags)
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | flags, 0o666)
+        try:
+            size = os.fstat(src_fd).st_size
+            try:
+                _kernel_copy(src_fd, dst_fd, size)
+            except _GiveupOnFastCopy:
+                if size > MMAP_COPY_THRESHOLD:
+                    # Hand the mapped pages straight to write()
+                    with mmap.mmap(src_fd, size, access=mmap.ACCESS_READ) as mm, \
+                            open(dst_fd, 'wb', closefd=False) as fdst:
+                        fdst.write(mm)
+                else:
+                    # Scale the buffer with the file size, capped at 8 MiB
+                    length = max(COPY_BUFSIZE, min(size, 8 * 1024 * 1024))
+                    with open(src_fd, 'rb', buffering=0, closefd=False) as fsrc, \
+                            open(dst_fd, 'wb', closefd=False) as fdst:
+                        _copy_fileobj_readinto(fsrc, fdst, length)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    
+    shutil.copystat(src, dst)
+
+def get_io_pool() -> ThreadPoolExecutor:
+    """Get the process-wide thread pool for blocking download and file I/O
+    
+    The pool is created on first use and reused afterwards, so each batch of
+    downloads doesn't start and tear down its own worker threads. Work
+    submitted to it must not wait on other work in the same pool.
+    
+    Returns:
+        ThreadPoolExecutor: Shared I/O pool
+    """
+    global _io_pool
+    
+    if _io_pool is None:
+        with _io_pool_lock:
+            if _io_pool is None:
+                _io_pool = ThreadPoolExecutor(
+                    max_workers=MAX_IO_WORKERS,
+                    thread_name_prefix="io"
+                )
+    return _io_pool
+
+def link_or_copy(src: str, dst: str) -> None:
+    """Place a file at a new path, hard-linking it when possible
+    
+    A hard link is a metadata-only operation and leaves the source in place;
+    the data is copied with fast_copy when the paths are on different
+    filesystems, the filesystem does not support links, or dst already exists.
+    
+    Args:
+        src (str): Source file path
+        dst (str): Destination file path
+    """
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    fast_copy(src, dst)
+
+def write_base64_file(data: Any, path: Path, urlsafe: bool = True) -> int:
+    """Decode base64 data into a file in fixed-size chunks
+    
+    Avoids materializing the whole decoded payload in memory.
+    
+    Args:
+        data (str | bytes): Base64-encoded content
+        path (Path): Destination file path
+        urlsafe (bool): Whether data uses the URL-safe alphabet
         
-        if not new_path.exists():
-            return new_path
-        counter += 1
+    Returns:
+        int: Number of decoded bytes written
+    """
+    if isinstance(data, str):
+        data = data.encode('ascii')
+    
+    view = memoryview(data)
+    written = 0
+    pending = []
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        for start in range(0, len(view), BASE64_CHUNK_SIZE):
+            chunk = view[start:start + BASE64_CHUNK_SIZE].tobytes()
+            if urlsafe:
+                chunk = chunk.translate(_URLSAFE_TO_STANDARD)
+            if len(chunk) % 4:
+                chunk += b'=' * (-len(chunk) % 4)
+            decoded = binascii.a2b_base64(chunk)
+            written += len(decoded)
+            pending.append(decoded)
+            if len(pending) >= WRITEV_BATCH:
+                _write_buffers(fd, pending)
+                pending = []
+        if pending:
+            _write_buffers(fd, pending)
+    finally:
+        os.close(fd)
+    
+    return written
+
+def _write_buffers(fd: int, buffers: List[bytes]) -> None:
+    """Write several buffers to a file descriptor, using one writev call where available
+    
+    Args:
+        fd (int): Open file descriptor
+        buffers (List[bytes]): Buffers to write in order
+    """
+    written = os.writev(fd, buffers) if hasattr(os, 'writev') else 0
+    
+    # Finish anything a partial (or unavailable) writev left behind
+    for buf in buffers:
+        if written >= len(buf):
+            written -= len(buf)
+            continue
+        remaining = memoryview(buf)[written:]
+        written = 0
+        while remaining:
+            remaining = remaining[os.write(fd, remaining):]
 
 def format_timestamp(timestamp_str: str) -> Optional[str]:
     """Format timestamp to readable date
@@ -81,6 +443,13 @@ def format_timestamp(timestamp_str: str) -> Optional[str]:
     """
     if not timestamp_str:
         return None
+    
+    # Fast path for the fixed-width YYYY-MM-DDTHH:MM:SSZ format
+    if (len(timestamp_str) == 20 and timestamp_str[10] == 'T' and timestamp_str[19] == 'Z'
+            and timestamp_str[4] == timestamp_str[7] == '-'
+            and timestamp_str[13] == timestamp_str[16] == ':'):
+        return f"{timestamp_str[:10]} {timestamp_str[11:19]}"
+    
     try:
         dt = datetime.strptime(timestamp_str, "%Y-%m-%dT%H:%M:%SZ")
         return dt.strftime("%Y-%m-%d %H:%M:%S")
@@ -114,6 +483,48 @@ def format_currency(amount: float, currency: str = "USD") -> str:
         return f"${amount:,.2f}"
     return f"{amount:,.2f} {currency}"
 
+def find_json_span(text: str) -> Optional[Tuple[int, int]]:
+    """Locate the first complete JSON object or array embedded in text
+    
+    Scans once, tracking nesting depth and skipping brackets inside quoted
+    strings, so prose before or after the JSON (as in LLM replies) is ignored.
+    
+    Args:
+        text (str): Text that may contain JSON
+        
+    Returns:
+        tuple: (start, end) slice of the JSON value, or None if there is none
+    """
+    start = -1
+    depth = 0
+    in_string = False
+    escape = False
+    
+    for i, ch in enumerate(text):
+        if start < 0:
+            if ch == '{' or ch == '[':
+                start = i
+                depth = 1
+            continue
+        
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == '{' or ch == '[':
+            depth += 1
+        elif ch == '}' or ch == ']':
+            depth -= 1
+            if depth == 0:
+                return start, i + 1
+    
+    return None
+
 def get_env_file_path() -> Path:
     """Get the correct .env file path.
     
@@ -138,9 +549,22 @@ def get_env_file_path() -> Path:
             
     raise FileNotFoundError("Could not find .env file in any expected location")
 
+@functools.lru_cache(maxsize=None)
+def _build_openai_client(api_key: str, model_name: str, temperature: float) -> ChatOpenAI:
+    """Build an OpenAI client, memoized on its configuration"""
+    return ChatOpenAI(
+        api_key=api_key,
+        model=model_name,
+        temperature=temperature
+    )
+
 def get_openai_client(model_name: str = None, temperature: float = 0) -> ChatOpenAI:
     """Get shared OpenAI client instance.
     
+    The environment is reloaded on every call, but the client is only built
+    once per API key, model and temperature and then reused, so callers that
+    ask for it per invoice don't construct a new HTTP client each time.
+    
     Args:
         model_name (str, optional): OpenAI model to use. Defaults to env var or gpt-4
         temperature (float, optional): Model temperature. Defaults to 0
@@ -168,14 +592,8 @@ def get_openai_client(model_name: str = None, temperature: float = 0) -> ChatOpe
     if not model_name:
         model_name = os.getenv("OPENAI_MODEL", "gpt-4")
     
-    # Initialize client with proper configuration
-    client = ChatOpenAI(
-        api_key=api_key,
-        model=model_name,
-        temperature=temperature
-    )
-    
-    return client
+    # Reuse the client built for this configuration, if any
+    return _build_openai_client(api_key, model_name, temperature)
 
 def init_composio(debug: bool = False) -> None:
     """Initialize Composio client with API key
@@ -194,8 +612,11 @@ def init_composio(debug: bool = False) -> None:
         # Initialize client
         _composio_client = ComposioToolSet(api_key=api_key)
         
-        # Test connection by getting basic tools
+        # Test connection by getting basic tools, and keep them so the first
+        # get_composio_tool('GMAIL_FETCH_EMAILS') doesn't fetch them again
         tools = _composio_client.get_tools(actions=['GMAIL_FETCH_EMAILS'])
+        for tool in tools:
+            _tool_by_action.setdefault(tool.name, tool)
         
         if debug:
             debug_print("Composio Client Initialized", {
@@ -210,6 +631,14 @@ def init_composio(debug: bool = False) -> None:
             debug_print("Initialization Error", error_msg)
         raise RuntimeError(error_msg)
 
+@functools.lru_cache(maxsize=64)
+def _fetch_composio_tools(actions: Optional[Tuple[str, ...]], kwargs: Tuple) -> List:
+    """Fetch tools from Composio, memoized on the sorted actions and kwargs"""
+    return _composio_client.get_tools(
+        actions=list(actions) if actions is not None else None,
+        **dict(kwargs)
+    )
+
 def get_composio_tools(actions: Optional[List[str]] = None, debug: bool = False, **kwargs) -> List:
     """Get Composio tools for specific actions
     
@@ -223,33 +652,27 @@ def get_composio_tools(actions: Optional[List[str]] = None, debug: bool = False,
         List: List of tools for the specified actions
     """
     try:
-        global _composio_client
-        
-        # Create a cache key from the actions and kwargs
-        cache_key = str(sorted(actions or [])) + str(sorted(kwargs.items()))
-        
-        # Check if tools are already cached
-        if cache_key in _tools_cache:
-            if debug:
-                debug_print("Using Cached Tools", {
-                    "actions": actions,
-                    "cache_key": cache_key
-                })
-            return _tools_cache[cache_key]
-        
         # Initialize client if not already initialized
-        if not _composio_client:
-            init_composio(debug=debug)
+        with _composio_init_lock:
+            if not _composio_client:
+                init_composio(debug=debug)
         
-        # Get and cache the tools
-        tools = _composio_client.get_tools(actions=actions, **kwargs)
-        _tools_cache[cache_key] = tools
+        actions_key = tuple(sorted(actions)) if actions is not None else None
+        kwargs_key = tuple(sorted(kwargs.items()))
+        try:
+            hash(kwargs_key)
+        except TypeError:
+            # Unhashable kwargs values can't be cached
+            tools = _composio_client.get_tools(actions=actions, **kwargs)
+        else:
+            tools = _fetch_composio_tools(actions_key, kwargs_key)
         
         if debug:
-            debug_print("Got New Tools", {
+            debug_print("Got Tools", {
                 "actions": actions,
                 "num_tools": len(tools),
-                "tool_names": [t.name for t in tools]
+                "tool_names": [t.name for t in tools],
+                "cache": _fetch_composio_tools.cache_info()._asdict()
             })
         
         return tools
@@ -273,8 +696,98 @@ def get_composio_tool(action: str, debug: bool = False) -> Optional[Any]:
     Returns:
         Any: Tool for the specified action, or None if not found
     """
-    tools = get_composio_tools(actions=[action], debug=debug)
-    return tools[0] if tools else None
+    tool = _tool_by_action.get(action)
+    if tool is None and action in _prefetch_events:
+        # Wait for a background prefetch of this action to finish
+        _prefetch_events[action].wait()
+        tool = _tool_by_action.get(action)
+    if tool is None:
+        tools = get_composio_tools(actions=[action], debug=debug)
+        if not tools:
+            return None
+        tool = _tool_by_action[action] = tools[0]
+    return tool
+
+def warm_composio_tools(actions: List[str], debug: bool = False) -> None:
+    """Fetch tools for several actions in one request and cache each by action
+    
+    Args:
+        actions (List[str]): Action names to prefetch
+        debug (bool): Enable debug output
+    """
+    for tool in get_composio_tools(actions=actions, debug=debug):
+        _tool_by_action[tool.name] = tool
+
+def configure_composio_http_pool(pool_size: int, debug: bool = False) -> None:
+    """Size the Composio HTTP connection pool for concurrent tool calls
+    
+    Tool calls share the Composio client's requests session; by default it
+    keeps fewer pooled connections than concurrent callers may need, which
+    forces fresh TLS handshakes.
+    
+    Args:
+        pool_size (int): Number of connections to keep alive per host
+        debug (bool): Enable debug output
+    """
+    global _composio_pool_size
+    
+    with _composio_init_lock:
+        if not _composio_client:
+            init_composio(debug=debug)
+        
+        if _composio_pool_size >= pool_size:
+            return
+        
+        http = getattr(getattr(_composio_client, 'client', None), 'http', None)
+        if not isinstance(http, requests.Session):
+            return
+        
+        # Only resize the stock adapter, keeping the retry policy the SDK set
+        adapter = http.get_adapter('https://')
+        if type(adapter) is not HTTPAdapter:
+            return
+        http.mount('https://', HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=adapter.max_retries
+        ))
+        _composio_pool_size = pool_size
+    
+    if debug:
+        debug_print("Composio HTTP Pool Configured", {"pool_size": pool_size})
+
+def prefetch_composio_tools(actions: List[str], debug: bool = False) -> None:
+    """Start fetching tools in a background thread
+    
+    get_composio_tool waits for the prefetch of an action instead of issuing
+    its own request, so tool discovery overlaps with the rest of start-up.
+    
+    Args:
+        actions (List[str]): Action names to prefetch
+        debug (bool): Enable debug output
+    """
+    # Skip actions that are already cached or being fetched
+    actions = [a for a in actions if a not in _tool_by_action and a not in _prefetch_events]
+    if not actions:
+        return
+    
+    event = threading.Event()
+    for action in actions:
+        _prefetch_events[action] = event
+    
+    def run():
+        try:
+            warm_composio_tools(actions, debug=debug)
+        except Exception as e:
+            if debug:
+                debug_print("Tool Prefetch Error", {
+                    "error": str(e),
+                    "actions": actions
+                })
+        finally:
+            event.set()
+    
+    threading.Thread(target=run, daemon=True).start()
 
 def clear_composio_cache(debug: bool = False) -> None:
     """Clear the Composio tools cache
@@ -282,29 +795,43 @@ def clear_composio_cache(debug: bool = False) -> None:
     Args:
         debug (bool): Enable debug output
     """
-    global _tools_cache
     if debug:
         debug_print("Clearing Tools Cache", {
-            "num_cached": len(_tools_cache)
+            "num_cached": _fetch_composio_tools.cache_info().currsize
         })
-    _tools_cache.clear()
+    _fetch_composio_tools.cache_clear()
+    _tool_by_action.clear()
+    _prefetch_events.clear()
 
 # Create default shared OpenAI client instance
 openai_client = get_openai_client()
 
 __all__ = [
     'DEBUG',
+    'COPY_BUFSIZE',
+    'configure_logging',
     'debug_print',
+    'summarize_debug_data',
+    'dump_debug_json',
+    'serialize_firebase_data',
     'format_error',
     'get_safe_filename',
+    'fast_copy',
+    'get_io_pool',
+    'link_or_copy',
+    'write_base64_file',
     'format_timestamp',
     'ensure_directory',
     'format_currency',
+    'find_json_span',
     'get_env_file_path',
     'get_openai_client',
     'openai_client',
     'init_composio',
     'get_composio_tools',
     'get_composio_tool',
+    'warm_composio_tools',
+    'prefetch_composio_tools',
+    'configure_composio_http_pool',
     'clear_composio_cache'
 ] 
\ No newline at end of file